@@ -0,0 +1,132 @@
+import gzip
+import hashlib
+import re
+from functools import wraps
+from uuid import uuid4
+
+from backend_foodgram.metrics import record_cache
+from django.apps import apps
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+
+VERSION_KEY = 'foodgram:version:{}'
+# Версия корзины и списка покупок одного пользователя.
+SHOPPING_CART_VERSION = 'shopping_cart:{}'
+GZIP_RE = re.compile(r'\bgzip\b')
+
+
+def get_versions(*names):
+    """Текущие версии пространств имён кэша.
+
+    Версия - случайная строка без срока жизни; если ключ вытеснен
+    из кэша, выдаётся новая, и старые записи просто не находятся.
+    """
+    keys = {VERSION_KEY.format(name): name for name in names}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        cache.add(key, uuid4().hex, None)
+        found[key] = cache.get(key)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def get_cached(key):
+    """cache.get с учётом попадания в метрике кэша по префиксу key."""
+    value = cache.get(key)
+    record_cache(key.split(':')[1], value is not None)
+    return value
+
+
+def bump_versions(*names):
+    """Делает недействительными все записи, зависящие от names."""
+    cache.set_many(
+        {VERSION_KEY.format(name): uuid4().hex for name in names}, None
+    )
+
+
+def get_sql_tables(sql, using='default'):
+    """Таблицы проекта, которые читает SQL-запрос, включая подзапросы."""
+    quote_name = connections[using].ops.quote_name
+    return sorted(
+        model._meta.db_table
+        for model in apps.get_models(include_auto_created=True)
+        if quote_name(model._meta.db_table) in sql
+    )
+
+
+def cache_stream(chunks, key, timeout=None):
+    """Отдаёт chunks дальше и кэширует результат, если поток дочитан."""
+    content = []
+    for chunk in chunks:
+        content.append(chunk)
+        yield chunk
+    cache.set(key, b''.join(content), timeout)
+
+
+def make_key(prefix, *parts):
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return f'foodgram:{prefix}:{digest}'
+
+
+def versioned_response_cache(*models, per_user=False, user_versions=()):
+    """Кэширует успешные GET-ответы метода viewset до смены версий models.
+
+    Тело хранится готовым к отдаче, вместе со сжатой gzip копией.
+    ETag вычисляется из версий таблиц и адреса запроса, поэтому
+    на If-None-Match отвечаем 304 без обращения к базе данных.
+    per_user=True - ответ зависит от пользователя и кэшируется отдельно.
+    user_versions - шаблоны версий с id пользователя вместо версий
+    таблиц: изменения других пользователей не сбрасывают такой ответ.
+    """
+    tables = [model._meta.db_table for model in models]
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            versions = get_versions(*tables, *(
+                name.format(request.user.pk) for name in user_versions
+            ))
+            key = make_key(
+                'response', request.get_full_path(),
+                request.accepted_renderer.format, sorted(versions.items()),
+                request.user.pk if per_user else None
+            )
+            etag = f'W/"{key.rsplit(":", 1)[-1]}"'
+            if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+            if etag in parse_etags(if_none_match) or if_none_match == '*':
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+            cached = get_cached(key)
+            if cached is None:
+                response = method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                response = self.finalize_response(
+                    request, response, *args, **kwargs
+                )
+                response.render()
+                cached = {
+                    'content': response.content,
+                    'gzip': gzip.compress(response.content),
+                    'content_type': response['Content-Type'],
+                }
+                cache.set(key, cached)
+            accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+            if GZIP_RE.search(accept_encoding):
+                response = HttpResponse(
+                    cached['gzip'], content_type=cached['content_type']
+                )
+                response['Content-Encoding'] = 'gzip'
+            else:
+                response = HttpResponse(
+                    cached['content'], content_type=cached['content_type']
+                )
+            response['ETag'] = etag
+            patch_cache_control(response, no_cache=True, private=per_user)
+            patch_vary_headers(response, ('Accept-Encoding',))
+            return response
+        return wrapper
+    return decorator
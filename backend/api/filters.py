@@ -1,5 +1,46 @@
+import operator
+from functools import reduce
+
+from django import forms
+from django.core.cache import cache
+from django.db.models import (BigIntegerField, Exists, ExpressionWrapper, F,
+                              OuterRef, Q)
 from django_filters import FilterSet, filters
-from foodgram.models import Ingredient, Recipe, Tag
+from foodgram.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+
+from .cache import get_cached, get_versions, make_key
+from .search import search_recipes
+
+
+def get_tags(slugs):
+    """Пары (id, бит в маске) тегов по slug; неизвестные slug пропускаются.
+
+    Тегов немного, поэтому соответствие slug -> (id, бит) кэшируется
+    целиком до смены версии таблицы тегов.
+    """
+    table = Tag._meta.db_table
+    key = make_key('tags', get_versions(table)[table])
+    tags = get_cached(key)
+    if tags is None:
+        tags = {
+            slug: (tag_id, bit)
+            for slug, tag_id, bit
+            in Tag.objects.values_list('slug', 'id', 'bit')
+        }
+        cache.set(key, tags)
+    return [tags[slug] for slug in slugs if slug in tags]
+
+
+class MultipleSlugField(forms.Field):
+    """Список значений параметра (?tags=a&tags=b) без обращения к базе."""
+    widget = forms.SelectMultiple
+
+    def to_python(self, value):
+        return [slug for slug in value or () if slug]
+
+
+class MultipleSlugFilter(filters.Filter):
+    field_class = MultipleSlugField
 
 
 class RecipeFilter(FilterSet):
@@ -15,23 +56,62 @@ class RecipeFilter(FilterSet):
         method='filter_is_in_shopping_cart',
         label='shopping_cart',
     )
-    tags = filters.ModelMultipleChoiceFilter(queryset=Tag.objects.all(),
-                                             field_name='tags__slug',
-                                             to_field_name='slug',)
+    tags = MultipleSlugFilter(method='filter_tags')
+    q = filters.CharFilter(method='filter_q', label='search')
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',)
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'q',)
+
+    def filter_q(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def filter_tags(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тегов.
+
+        Проверяется маска тегов в строке рецепта; только теги без бита
+        (если их больше TAG_MASK_BITS) ищутся через recipe_tags.
+        """
+        mask = 0
+        unmasked = []
+        for tag_id, bit in get_tags(value):
+            if bit is None:
+                unmasked.append(tag_id)
+            else:
+                mask |= 1 << bit
+        conditions = []
+        if mask:
+            queryset = queryset.alias(tags_match=ExpressionWrapper(
+                F('tags_mask').bitand(mask), output_field=BigIntegerField()
+            ))
+            conditions.append(Q(tags_match__gt=0))
+        if unmasked:
+            conditions.append(Q(Exists(Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'), tag__in=unmasked
+            ))))
+        if not conditions:
+            return queryset.none()
+        return queryset.filter(reduce(operator.or_, conditions))
+
+    def filter_by_user_list(self, queryset, model, value):
+        """Рецепты, которые есть (value != 0) или которых нет в списке.
+
+        У анонимного пользователя списки пусты.
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none() if value else queryset
+        in_list = Exists(
+            model.objects.filter(user=user, recipe=OuterRef('pk'))
+        )
+        return queryset.filter(in_list if value else ~in_list)
 
     def filter_is_favorited(self, queryset, name, value):
-        if value and self.request.user.is_authenticated:
-            return queryset.filter(favorite_recipes__user=self.request.user)
-        return queryset.exclude(favorite_recipes__user=self.request.user)
+        return self.filter_by_user_list(queryset, Favorite, value)
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        if value and self.request.user.is_authenticated:
-            return queryset.filter(shopping_cart__user=self.request.user)
-        return queryset.exclude(shopping_cart__user=self.request.user)
+        return self.filter_by_user_list(queryset, ShoppingCart, value)
 
 
 class IngredientFilter(FilterSet):
@@ -0,0 +1,119 @@
+import logging
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.db import DatabaseError
+from foodgram.models import Ingredient
+
+from .cache import get_versions
+from .serializers import IngredientSerializer
+
+logger = logging.getLogger(__name__)
+
+FUZZY_MIN_LENGTH = 3
+FUZZY_THRESHOLD = 0.5
+WORD_RE = re.compile(r'\w+')
+
+_index = None
+_lock = threading.Lock()
+
+
+def normalize(value):
+    """Ключ поиска: без учёта регистра, «ё» не отличается от «е»."""
+    return value.casefold().replace('ё', 'е')
+
+
+def get_trigrams(value):
+    """Триграммы слов value, как их строит pg_trgm."""
+    return {
+        padded[index:index + 3]
+        for word in WORD_RE.findall(value)
+        for padded in [f'  {word} ']
+        for index in range(len(padded) - 2)
+    }
+
+
+class IngredientIndex:
+    """Неизменяемый индекс ингредиентов по префиксу названия.
+
+    Хранит уже сериализованные ингредиенты, отсортированные по
+    нормализованному названию; поиск - два бинарных поиска по списку.
+    Для нечёткого поиска есть обратный индекс триграмм названий.
+    """
+
+    def __init__(self, ingredients, version=None):
+        entries = sorted(
+            (normalize(item['name']), item['name'], item['id'], item)
+            for item in ingredients
+        )
+        self.keys = [entry[0] for entry in entries]
+        self.items = [entry[-1] for entry in entries]
+        self.version = version
+        self.trigrams = defaultdict(list)
+        for position, key in enumerate(self.keys):
+            for trigram in get_trigrams(key):
+                self.trigrams[trigram].append(position)
+
+    def __len__(self):
+        return len(self.items)
+
+    def startswith(self, prefix):
+        prefix = normalize(prefix)
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + chr(0x10ffff), lo=start)
+        return self.items[start:end]
+
+    def fuzzy(self, query, limit, threshold=FUZZY_THRESHOLD):
+        """Совпадения по началу названия, затем похожие по триграммам.
+
+        Сходство - доля триграмм запроса, найденных в названии;
+        просматриваются только названия с общими триграммами.
+        """
+        query = normalize(query)
+        start = bisect_left(self.keys, query)
+        end = bisect_left(self.keys, query + chr(0x10ffff), lo=start)
+        trigrams = get_trigrams(query)
+        matches = Counter()
+        for trigram in trigrams:
+            matches.update(self.trigrams.get(trigram, ()))
+        similar = sorted(
+            (-count, position) for position, count in matches.items()
+            if not start <= position < end
+            and count / len(trigrams) >= threshold
+        )
+        positions = [
+            *range(start, end), *(position for _, position in similar)
+        ]
+        return [self.items[position] for position in positions[:limit]]
+
+
+def get_ingredient_index():
+    """Индекс текущего процесса; перестраивается при смене версии.
+
+    Версия таблицы ингредиентов хранится в общем кэше и сбрасывается
+    сигналами api.signals, поэтому изменения видят все воркеры.
+    """
+    global _index
+    table = Ingredient._meta.db_table
+    version = get_versions(table)[table]
+    if _index is None or _index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                _index = IngredientIndex(
+                    IngredientSerializer(
+                        Ingredient.objects.all(), many=True
+                    ).data,
+                    version
+                )
+    return _index
+
+
+def warm_up():
+    """Строит индекс при старте воркера, если база уже доступна."""
+    try:
+        get_ingredient_index()
+    except DatabaseError:
+        logger.warning('Индекс ингредиентов будет построен при первом '
+                       'запросе: база данных недоступна.')
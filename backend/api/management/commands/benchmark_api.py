@@ -0,0 +1,292 @@
+import base64
+import io
+import json
+import math
+import tempfile
+import time
+from itertools import combinations
+from urllib.parse import urlencode
+
+from backend_foodgram.profiling import QueryTimer
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import override_settings
+from foodgram.models import Ingredient, IngredientRecipe, Recipe, Tag
+from PIL import Image
+from rest_framework.test import APIClient
+from users.models import User
+
+PERCENTILES = (50, 95, 99)
+# Разница меньше этой считается шумом измерения, а не регрессией.
+NOISE_MS = 1.0
+
+
+def percentile(values, rank):
+    """Перцентиль по ближайшему рангу."""
+    values = sorted(values)
+    return values[max(math.ceil(rank / 100 * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время ответа эндпоинтов API на текущей базе '
+            '(например, после seed_foodgram): p50/p95/p99, число '
+            'SQL-запросов и время в базе. Сохраните результат через '
+            '--output и передайте файл в --compare, чтобы команда '
+            'завершилась ошибкой при регрессии больше --threshold.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Email пользователя, от имени которого идут запросы. '
+                 'По умолчанию - автор с наибольшим числом рецептов.'
+        )
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=2,
+            help='Число прогонов каждого сценария, не попадающих в замер.'
+        )
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            help='Запускать только сценарии, содержащие эту строку.'
+        )
+        parser.add_argument(
+            '--cold',
+            action='store_true',
+            help='Очищать кэш перед каждым запросом.'
+        )
+        parser.add_argument(
+            '--output',
+            help='Сохранить результаты в JSON-файл.'
+        )
+        parser.add_argument(
+            '--compare',
+            help='JSON-файл с результатами предыдущего запуска.'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=20,
+            help='Допустимый рост p95 и времени в базе, в процентах.'
+        )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations должно быть больше 0.')
+        user = self.get_user(options['user'])
+        scenarios = [
+            scenario for scenario in self.get_scenarios(user)
+            if not options['scenario']
+            or any(part in scenario[0] for part in options['scenario'])
+        ]
+        if not scenarios:
+            raise CommandError('Нет подходящих сценариев.')
+        baseline = self.load(options['compare']) if options['compare'] else {}
+        client = APIClient()
+        client.force_authenticate(user)
+        results = {}
+        regressions = []
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(ALLOWED_HOSTS=['testserver'],
+                                   MEDIA_ROOT=media_root):
+                for scenario in scenarios:
+                    name = scenario[0]
+                    result = self.measure(client, scenario, options)
+                    results[name] = result
+                    problems = self.compare(
+                        result, baseline.get(name), options['threshold']
+                    )
+                    regressions.extend(f'{name}: {text}' for text in problems)
+                    self.write(name, result, baseline.get(name), problems)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+        if regressions:
+            raise CommandError(
+                'Регрессии относительно базового замера:\n'
+                + '\n'.join(regressions)
+            )
+
+    def get_user(self, email):
+        users = User.objects.annotate(total=Count('recipes'))
+        if email:
+            user = users.filter(email=email).first()
+            if user is None:
+                raise CommandError(f'Пользователь {email} не найден.')
+        else:
+            user = users.order_by('-total', 'pk').first()
+        if user is None or not user.total:
+            raise CommandError('Нужен пользователь с рецептами; '
+                               'заполните базу командой seed_foodgram.')
+        return user
+
+    def get_scenarios(self, user):
+        """Сценарии (название, метод, путь, тело запроса).
+
+        Изменяющие запросы идут последними: они сбрасывают версии кэша
+        и сделали бы следующие замеры «холодными».
+        """
+        recipe = (
+            Recipe.objects.annotate(total=Count('favorite_recipes'))
+            .order_by('-total', '-pk')
+            .first()
+        )
+        own_recipe = user.recipes.order_by('-pk').first()
+        ingredient = (
+            Ingredient.objects.annotate(total=Count('recipes'))
+            .order_by('-total', 'pk')
+            .values_list('name', flat=True)
+            .first()
+        )
+        filters = self.get_recipe_filters(user, recipe)
+        scenarios = []
+        for size in range(len(filters) + 1):
+            for params in combinations(filters, size):
+                query = urlencode(
+                    {key: filters[key] for key in params}, doseq=True
+                )
+                scenarios.append((
+                    ' '.join(('recipes', *params)), 'get',
+                    f'/api/recipes/?{query}', None
+                ))
+        scenarios.append((
+            'recipe detail', 'get', f'/api/recipes/{recipe.pk}/', None
+        ))
+        scenarios.append((
+            'subscriptions', 'get',
+            '/api/users/subscriptions/?recipes_limit=3', None
+        ))
+        if ingredient:
+            scenarios.append((
+                'ingredients autocomplete', 'get',
+                '/api/ingredients/?' + urlencode({'name': ingredient[:2]}),
+                None
+            ))
+            scenarios.append((
+                'ingredients fuzzy', 'get',
+                '/api/ingredients/?' + urlencode(
+                    {'name': ingredient[1:], 'fuzzy': 1}
+                ),
+                None
+            ))
+        scenarios.append((
+            'download_shopping_cart', 'get',
+            '/api/recipes/download_shopping_cart/', None
+        ))
+        payload = self.get_recipe_payload(own_recipe)
+        scenarios.append(('recipe create', 'post', '/api/recipes/', payload))
+        scenarios.append((
+            'recipe update', 'patch', f'/api/recipes/{own_recipe.pk}/',
+            payload
+        ))
+        return scenarios
+
+    def get_recipe_filters(self, user, recipe):
+        """Значения параметров RecipeFilter, дающие непустую выдачу."""
+        filters = {
+            'author': user.pk,
+            'tags': list(recipe.tags.values_list('slug', flat=True)[:2]),
+            'is_favorited': 1,
+            'is_in_shopping_cart': 1,
+            'q': recipe.name.split()[0] if recipe.name.split() else '',
+        }
+        return {key: value for key, value in filters.items() if value}
+
+    def get_recipe_payload(self, recipe):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), (200, 120, 40)).save(buffer, 'PNG')
+        image = base64.b64encode(buffer.getvalue()).decode()
+        ingredients = IngredientRecipe.objects.filter(recipe=recipe)
+        return {
+            'name': f'{recipe.name} (замер)',
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'image': f'data:image/png;base64,{image}',
+            'tags': list(
+                recipe.tags.values_list('pk', flat=True)
+                or Tag.objects.values_list('pk', flat=True)[:1]
+            ),
+            'ingredients': [
+                {'id': item.ingredient_id, 'amount': item.quantity + 1}
+                for item in ingredients
+            ],
+        }
+
+    def measure(self, client, scenario, options):
+        name, method, path, data = scenario
+        timings = []
+        queries = []
+        sql_timings = []
+        for iteration in range(options['warmup'] + options['iterations']):
+            if options['cold']:
+                cache.clear()
+            # Изменения откатываются, чтобы замеры не меняли базу.
+            timer = QueryTimer()
+            with transaction.atomic():
+                with connection.execute_wrapper(timer):
+                    start = time.perf_counter()
+                    response = getattr(client, method)(
+                        path, data, format='json'
+                    )
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    duration = (time.perf_counter() - start) * 1000
+                transaction.set_rollback(True)
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'{name}: ответ {response.status_code} на {path}.'
+                )
+            if iteration < options['warmup']:
+                continue
+            timings.append(duration)
+            queries.append(timer.count)
+            sql_timings.append(timer.duration)
+        result = {
+            f'p{rank}': round(percentile(timings, rank), 3)
+            for rank in PERCENTILES
+        }
+        result['queries'] = percentile(queries, 50)
+        result['sql'] = round(percentile(sql_timings, 50), 3)
+        return result
+
+    def compare(self, result, previous, threshold):
+        """Описания регрессий result относительно previous."""
+        if not previous:
+            return []
+        problems = []
+        factor = 1 + threshold / 100
+        for key in ('p95', 'sql'):
+            if result[key] > previous[key] * factor + NOISE_MS:
+                problems.append(
+                    f'{key} {result[key]:.2f} ms (было {previous[key]:.2f})'
+                )
+        if result['queries'] > previous['queries']:
+            problems.append(
+                f'запросов {result["queries"]} (было {previous["queries"]})'
+            )
+        return problems
+
+    def write(self, name, result, previous, problems):
+        parts = []
+        for key in (*(f'p{rank}' for rank in PERCENTILES), 'sql'):
+            text = f'{key}={result[key]:.2f}ms'
+            if previous:
+                text += f' ({previous[key]:.2f})'
+            parts.append(text)
+        text = f'queries={result["queries"]}'
+        if previous:
+            text += f' ({previous["queries"]})'
+        parts.append(text)
+        style = self.style.ERROR if problems else self.style.SUCCESS
+        self.stdout.write(f'{style(name.ljust(60))} {" ".join(parts)}')
+
+    def load(self, path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
@@ -0,0 +1,180 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from foodgram.models import Tag
+from rest_framework.test import APIClient
+from users.models import User
+
+SKIPPED_STATEMENTS = ('BEGIN', 'COMMIT', 'SAVEPOINT', 'RELEASE', 'ROLLBACK')
+
+
+class Command(BaseCommand):
+    help = ('Выполняет запросы списков рецептов и пользователей '
+            'и выводит план (EXPLAIN) каждого SQL-запроса. '
+            'Чтобы сравнить индексы, сохраните планы через --output '
+            'до миграции и передайте файл в --compare после неё: '
+            'запросы сопоставляются по тексту SQL.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Email пользователя, от имени которого идут запросы. '
+                 'По умолчанию - пользователь с самым большим избранным.'
+        )
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help='Выполнять запросы и показывать фактическое время.'
+        )
+        parser.add_argument(
+            '--output',
+            help='Сохранить планы в JSON-файл.'
+        )
+        parser.add_argument(
+            '--compare',
+            help='JSON-файл с планами предыдущего запуска для сравнения.'
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        results = []
+        for name, path in self.get_scenarios():
+            for sql in self.capture(user, path):
+                plan, cost, duration = self.explain(sql, options['analyze'])
+                results.append({
+                    'scenario': name,
+                    'sql': sql,
+                    'plan': plan,
+                    'cost': cost,
+                    'time': duration,
+                })
+        baseline = self.load(options['compare']) if options['compare'] else {}
+        for result in results:
+            previous = baseline.get((result['scenario'], result['sql']))
+            self.stdout.write(self.style.MIGRATE_HEADING(result['scenario']))
+            self.stdout.write(f'  {result["sql"][:200]}')
+            for line in result['plan']:
+                self.stdout.write(f'    {line}')
+            self.stdout.write(f'  {self.format_metrics(result, previous)}')
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+
+    def get_user(self, email):
+        if email:
+            user = User.objects.filter(email=email).first()
+            if user is None:
+                raise CommandError(f'Пользователь {email} не найден.')
+            return user
+        user = (
+            User.objects.annotate(favorites=Count('favorite_recipes'))
+            .order_by('-favorites', 'pk')
+            .first()
+        )
+        if user is None:
+            raise CommandError('В базе нет пользователей.')
+        return user
+
+    def get_scenarios(self):
+        author = (
+            User.objects.annotate(total=Count('recipes'))
+            .order_by('-total', 'pk')
+            .values_list('pk', flat=True)
+            .first()
+        )
+        tags = list(
+            Tag.objects.annotate(total=Count('recipes'))
+            .order_by('-total', 'pk')
+            .values_list('slug', flat=True)[:2]
+        )
+        scenarios = [
+            ('recipes', '/api/recipes/'),
+            ('recipes page 2', '/api/recipes/?page=2'),
+            ('recipes cursor', '/api/recipes/?pagination=cursor'),
+            ('recipes author', f'/api/recipes/?author={author}'),
+            ('recipes favorited', '/api/recipes/?is_favorited=1'),
+            ('recipes in cart', '/api/recipes/?is_in_shopping_cart=1'),
+            ('users', '/api/users/'),
+            ('subscriptions', '/api/users/subscriptions/'),
+            ('subscriptions limit',
+             '/api/users/subscriptions/?recipes_limit=3'),
+        ]
+        if tags:
+            scenarios.append(('recipes tags', '/api/recipes/?' + '&'.join(
+                f'tags={slug}' for slug in tags
+            )))
+        return scenarios
+
+    def capture(self, user, path):
+        client = APIClient()
+        client.force_authenticate(user)
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            with CaptureQueriesContext(connection) as context:
+                response = client.get(path)
+        if response.status_code != 200:
+            raise CommandError(f'{path}: ответ {response.status_code}.')
+        return [
+            query['sql'] for query in context.captured_queries
+            if not query['sql'].startswith(SKIPPED_STATEMENTS)
+        ]
+
+    def explain(self, sql, analyze):
+        """План запроса, его оценка стоимости и время выполнения в мс."""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                options = 'ANALYZE, FORMAT JSON' if analyze else 'FORMAT JSON'
+                cursor.execute(f'EXPLAIN ({options}) {sql}')
+                explained = cursor.fetchone()[0]
+                if isinstance(explained, str):
+                    explained = json.loads(explained)
+                explained = explained[0]
+                return (
+                    list(self.format_node(explained['Plan'])),
+                    explained['Plan']['Total Cost'],
+                    explained.get('Execution Time'),
+                )
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+            duration = None
+            if analyze:
+                start = time.perf_counter()
+                cursor.execute(sql)
+                cursor.fetchall()
+                duration = (time.perf_counter() - start) * 1000
+            return plan, None, duration
+
+    def format_node(self, node, depth=0):
+        line = node['Node Type']
+        if 'Index Name' in node:
+            line += f' using {node["Index Name"]}'
+        if 'Relation Name' in node:
+            line += f' on {node["Relation Name"]}'
+        yield f'{"  " * depth}{line} (cost={node["Total Cost"]})'
+        for child in node.get('Plans', ()):
+            yield from self.format_node(child, depth + 1)
+
+    def format_metrics(self, result, previous):
+        parts = []
+        for key, unit in (('cost', ''), ('time', ' ms')):
+            value = result[key]
+            if value is None:
+                continue
+            text = f'{key}={value:.2f}{unit}'
+            if previous and previous.get(key) is not None:
+                text += f' (было {previous[key]:.2f}{unit})'
+            parts.append(text)
+        return ', '.join(parts) or 'без оценки'
+
+    def load(self, path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                return {
+                    (result['scenario'], result['sql']): result
+                    for result in json.load(file)
+                }
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
@@ -1,5 +1,221 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+
+from backend_foodgram.metrics import PAGE_BUCKETS, registry
+from django.core.cache import cache
+from django.core.exceptions import (EmptyResultSet, FieldDoesNotExist,
+                                    ValidationError)
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .cache import get_cached, get_sql_tables, get_versions, make_key
+
+
+class CountStrategyPaginator(Paginator):
+    """Paginator с настраиваемым способом подсчёта count.
+
+    exact - обычный COUNT(*);
+    cached - COUNT(*) кэшируется по SQL запроса и версиям таблиц,
+    которые он читает (версии сбрасываются сигналами в api.signals);
+    estimated - для запросов без фильтров по большим таблицам
+    берётся оценка планировщика PostgreSQL, иначе как cached.
+    """
+
+    def __init__(self, object_list, per_page, strategy='exact',
+                 cache_timeout=None, estimate_threshold=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.strategy = strategy
+        self.cache_timeout = cache_timeout
+        self.estimate_threshold = estimate_threshold
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if self.strategy == 'exact' or not isinstance(queryset, QuerySet):
+            return super().count
+        if self.strategy == 'estimated' and not queryset.query.where:
+            estimate = self.get_estimate(queryset)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        versions = get_versions(*get_sql_tables(sql, queryset.db))
+        key = make_key(
+            'count', queryset.db, sql, params, sorted(versions.items())
+        )
+        count = get_cached(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, self.cache_timeout)
+        return count
+
+    @staticmethod
+    def get_estimate(queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] < 0:
+            return None
+        return int(row[0])
 
 
 class CustomPagination(PageNumberPagination):
     page_size = 6
+    count_strategy = 'estimated'
+    count_cache_timeout = 30
+    count_estimate_threshold = 100000
+
+    def django_paginator_class(self, object_list, per_page):
+        return CountStrategyPaginator(
+            object_list,
+            per_page,
+            strategy=self.count_strategy,
+            cache_timeout=self.count_cache_timeout,
+            estimate_threshold=self.count_estimate_threshold,
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = super().paginate_queryset(queryset, request, view)
+        if page is not None:
+            registry.observe(
+                'foodgram_pagination_page', self.page.number, PAGE_BUCKETS,
+                view=getattr(request.resolver_match, 'view_name', None)
+            )
+        return page
+
+
+class KeysetPagination(BasePagination):
+    """Курсорная пагинация по ключу сортировки без COUNT и OFFSET.
+
+    Ключ берётся из сортировки запроса (или Meta.ordering модели)
+    и дополняется pk, поэтому позиция однозначна даже при совпадающих
+    датах, а глубокие страницы стоят столько же, сколько первая.
+    """
+    page_size = CustomPagination.page_size
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(
+                self.get_position_filter(queryset.model, cursor)
+            )
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_ordering(self, queryset):
+        ordering = list(
+            queryset.query.order_by or queryset.model._meta.ordering
+        )
+        names = {field.lstrip('-') for field in ordering}
+        if not names & {'pk', 'id'}:
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-pk' if descending else 'pk')
+        return ordering
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        position = [
+            self.encode_value(getattr(last, field.lstrip('-')))
+            for field in self.ordering
+        ]
+        cursor = base64.urlsafe_b64encode(
+            json.dumps(position).encode()
+        ).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            cursor
+        )
+
+    def get_position_filter(self, model, cursor):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(position) != len(self.ordering):
+                raise ValueError
+            values = [
+                self.decode_value(model, field.lstrip('-'), value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (TypeError, ValueError, ValidationError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        position_filter = Q()
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition = Q(**{f'{name}__{lookup}': values[index]})
+            for previous, value in zip(self.ordering[:index], values):
+                condition &= Q(**{previous.lstrip('-'): value})
+            position_filter |= condition
+        return position_filter
+
+    @staticmethod
+    def encode_value(value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+    @staticmethod
+    def decode_value(model, name, value):
+        if name == 'pk':
+            field = model._meta.pk
+        else:
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return value
+        return field.to_python(value)
+
+
+class PaginationModeMixin:
+    """Выбор пагинации на уровне запроса.
+
+    ?pagination=cursor (или переданный курсор) включает
+    KeysetPagination вместо постраничной.
+    """
+    keyset_pagination_class = KeysetPagination
+    pagination_mode_query_param = 'pagination'
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.use_keyset_pagination():
+            self._paginator = self.keyset_pagination_class()
+        return super().paginator
+
+    def use_keyset_pagination(self):
+        if self.pagination_class is None:
+            return False
+        params = self.request.query_params
+        return (
+            params.get(self.pagination_mode_query_param) == 'cursor'
+            or self.keyset_pagination_class.cursor_query_param in params
+        )
@@ -0,0 +1,178 @@
+import re
+from collections import defaultdict
+
+from django.contrib.postgres.lookups import PostgresOperatorLookup
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections, transaction
+from django.db.models import (BooleanField, Case, CharField, ExpressionWrapper,
+                              F, FloatField, Func, Q, Value, When)
+from foodgram.models import SEARCH_CONFIG, Ingredient, IngredientRecipe
+
+from .ingredient_index import (FUZZY_MIN_LENGTH, FUZZY_THRESHOLD,
+                               get_ingredient_index, normalize)
+from .serializers import IngredientSerializer
+
+WORD_RE = re.compile(r'\w+')
+# Веса частей рецепта, как у SearchRank для A, B и C.
+FIELD_WEIGHTS = {'name': 1.0, 'ingredients': 0.4, 'text': 0.2}
+FUZZY_LIMIT = 20
+
+_trigram_support = {}
+
+
+@CharField.register_lookup
+class TrigramWordSimilar(PostgresOperatorLookup):
+    """name__trigram_word_similar: оператор pg_trgm %>, использует индекс."""
+    lookup_name = 'trigram_word_similar'
+    postgres_operator = '%%>'
+
+
+class TrigramWordSimilarity(Func):
+    function = 'WORD_SIMILARITY'
+    output_field = FloatField()
+
+    def __init__(self, string, expression, **extra):
+        super().__init__(Value(string), expression, **extra)
+
+
+class PostgresRecipeSearch:
+    """Поиск по search_vector рецептов через GIN-индекс."""
+
+    def search(self, queryset, query):
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return (
+            queryset
+            .filter(search_vector=search_query)
+            .annotate(rank=SearchRank(F('search_vector'), search_query))
+            .order_by('-rank', '-pub_date')
+        )
+
+
+class PythonRecipeSearch:
+    """Поиск без PostgreSQL, для тестов и разработки на SQLite.
+
+    Перебирает все рецепты выборки; вместо морфологии слова запроса
+    сравниваются с началом слов рецепта без последних двух букв.
+    """
+
+    def search(self, queryset, query):
+        terms = [self.stem(word) for word in self.words(query)]
+        if not terms:
+            return queryset.none()
+        ingredients = defaultdict(list)
+        for recipe_id, name in IngredientRecipe.objects.filter(
+            recipe__in=queryset.values('pk')
+        ).values_list('recipe_id', 'ingredient__name'):
+            ingredients[recipe_id].append(name)
+        ranks = {}
+        for pk, name, text in queryset.values_list('pk', 'name', 'text'):
+            fields = {
+                'name': self.words(name),
+                'ingredients': self.words(' '.join(ingredients[pk])),
+                'text': self.words(text),
+            }
+            rank = 0
+            for term in terms:
+                matched = [
+                    FIELD_WEIGHTS[field] for field, words in fields.items()
+                    if any(word.startswith(term) for word in words)
+                ]
+                if not matched:
+                    break
+                rank += max(matched)
+            else:
+                ranks[pk] = rank
+        if not ranks:
+            return queryset.none()
+        return (
+            queryset
+            .filter(pk__in=ranks)
+            .annotate(rank=Case(
+                *(When(pk=pk, then=Value(rank)) for pk, rank in ranks.items()),
+                output_field=FloatField()
+            ))
+            .order_by('-rank', '-pub_date')
+        )
+
+    @staticmethod
+    def words(value):
+        return WORD_RE.findall(normalize(value))
+
+    @staticmethod
+    def stem(word):
+        return word[:max(3, len(word) - 2)]
+
+
+def search_recipes(queryset, query):
+    """Рецепты, подходящие под запрос, по убыванию релевантности."""
+    if connections[queryset.db].vendor == 'postgresql':
+        backend = PostgresRecipeSearch()
+    else:
+        backend = PythonRecipeSearch()
+    return backend.search(queryset, query)
+
+
+class PostgresIngredientSearch:
+    """Нечёткий поиск ингредиентов через pg_trgm и GIN-индекс по name."""
+
+    def search(self, query, limit):
+        ingredients = (
+            Ingredient.objects
+            .filter(name__trigram_word_similar=query)
+            .annotate(
+                is_prefix=ExpressionWrapper(
+                    Q(name__istartswith=query), output_field=BooleanField()
+                ),
+                similarity=TrigramWordSimilarity(query, 'name'),
+            )
+            .order_by('-is_prefix', '-similarity', 'name')
+        )
+        with transaction.atomic(using=ingredients.db):
+            with connections[ingredients.db].cursor() as cursor:
+                cursor.execute(
+                    "SELECT set_config("
+                    "'pg_trgm.word_similarity_threshold', %s, true)",
+                    [str(FUZZY_THRESHOLD)]
+                )
+            return IngredientSerializer(
+                ingredients[:limit], many=True
+            ).data
+
+
+class IndexIngredientSearch:
+    """Нечёткий поиск по n-граммам индекса ингредиентов в памяти."""
+
+    def search(self, query, limit):
+        return get_ingredient_index().fuzzy(query, limit)
+
+
+def search_ingredients(query, limit=FUZZY_LIMIT):
+    """Ингредиенты, похожие на query.
+
+    Сначала идут совпадения по началу названия, затем остальные
+    по убыванию сходства. Короткие запросы ищутся только по началу.
+    """
+    if len(query) < FUZZY_MIN_LENGTH:
+        return get_ingredient_index().startswith(query)[:limit]
+    if has_trigram_support(Ingredient.objects.db):
+        backend = PostgresIngredientSearch()
+    else:
+        backend = IndexIngredientSearch()
+    return backend.search(query, limit)
+
+
+def has_trigram_support(using):
+    """Установлено ли в базе расширение pg_trgm (проверяется один раз)."""
+    if using not in _trigram_support:
+        connection = connections[using]
+        supported = False
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+                )
+                supported = cursor.fetchone() is not None
+        _trigram_support[using] = supported
+    return _trigram_support[using]
@@ -1,14 +1,22 @@
+from functools import partial
+
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_base64.fields import Base64ImageField
 from foodgram.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                             ShoppingCart, Tag)
+                             ShoppingCart, ShoppingListItem, Tag,
+                             get_tags_mask)
 from rest_framework import serializers
 from rest_framework.serializers import ValidationError
 from rest_framework.validators import UniqueValidator
 from users.models import Follow, User
 
+from .cache import bump_versions
+from .signals import per_row_refresh_paused
 from .validators import validate_username
 
+BATCH_MAX_SIZE = 100
+
 
 class UserReadSerializer(UserSerializer):
     """Получение списка пользователей."""
@@ -21,9 +29,12 @@ class UserReadSerializer(UserSerializer):
                   'is_subscribed')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         if (
             self.context.get('request')
             and not self.context['request'].user.is_anonymous
+            and self.context['request'].user != obj
         ):
             return Follow.objects.filter(user=self.context['request'].user,
                                          author=obj).exists()
@@ -108,6 +119,15 @@ class RecipeSerializer(serializers.ModelSerializer):
         read_only_fields = ('name', 'cooking_time',)
 
 
+class BatchSerializer(serializers.Serializer):
+    """Список id для пакетных операций."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_MAX_SIZE
+    )
+
+
 class FollowingListSerializer(serializers.ModelSerializer):
     """Список подписок пользователя."""
     is_subscribed = serializers.SerializerMethodField()
@@ -122,6 +142,8 @@ class FollowingListSerializer(serializers.ModelSerializer):
                   'recipes_quantity', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
+        if 'is_subscribed' in self.context:
+            return self.context['is_subscribed']
         return (
             self.context.get('request').user.is_authenticated
             and Follow.objects.filter(user=self.context['request'].user,
@@ -129,48 +151,39 @@ class FollowingListSerializer(serializers.ModelSerializer):
         )
 
     def get_recipes_quantity(self, obj):
+        if hasattr(obj, 'recipes_quantity'):
+            return obj.recipes_quantity
         return obj.recipes.count()
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
+        recipes = getattr(obj, 'recipes_preview', None)
+        if recipes is None:
+            request = self.context.get('request')
+            limit = request.GET.get('recipes_limit')
+            recipes = obj.recipes.all()
+            if limit:
+                recipes = recipes[:int(limit)]
         serializer = RecipeSerializer(recipes, many=True, read_only=True)
         return serializer.data
 
 
-class FollowAuthorSerializer(serializers.ModelSerializer):
+class FollowAuthorSerializer(FollowingListSerializer):
     """Подписка и отписка от авторов."""
-    recipes = RecipeSerializer(many=True, read_only=True)
-    recipes_quantity = serializers.SerializerMethodField()
-    is_subscribed = serializers.SerializerMethodField()
 
-    class Meta:
-        model = User
-        fields = ('email', 'id',
-                  'username', 'first_name',
-                  'last_name', 'recipes',
-                  'recipes_quantity', 'is_subscribed',)
+    class Meta(FollowingListSerializer.Meta):
         read_only_fields = ('email', 'username',)
 
-    def validate(self, obj):
-        if (self.context['request'].user == obj):
+    def validate(self, attrs):
+        user = self.context['request'].user
+        if user == self.instance:
             raise serializers.ValidationError(
                 'Нельзя подписаться на самого себя.'
             )
-        return obj
-
-    def get_recipes_quantity(self, obj):
-        return obj.recipes.count()
-
-    def get_is_subscribed(self, obj):
-        return (
-            self.context.get('request').user.is_authenticated
-            and Follow.objects.filter(user=self.context['request'].user,
-                                      author=obj).exists()
-        )
+        if Follow.objects.filter(user=user, author=self.instance).exists():
+            raise serializers.ValidationError(
+                'Вы уже подписаны на этого автора.'
+            )
+        return attrs
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -202,6 +215,21 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
                   'measurement_unit', 'amount')
 
 
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    """Ингредиент из списка покупок с общим количеством."""
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+    amount = serializers.ReadOnlyField(source='total_quantity')
+
+    class Meta:
+        model = ShoppingListItem
+        fields = ('id', 'name',
+                  'measurement_unit', 'amount')
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
     """Список рецептов"""
     author = UserReadSerializer(read_only=True)
@@ -222,6 +250,8 @@ class RecipeReadSerializer(serializers.ModelSerializer):
                   'text', 'cooking_time')
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return (
             self.context.get('request').user.is_authenticated
             and Favorite.objects.filter(user=self.context['request'].user,
@@ -229,6 +259,8 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return (
             self.context.get('request').user.is_authenticated
             and ShoppingCart.objects.filter(
@@ -302,31 +334,83 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Ингредиенты должны быть уникальны.'
             )
+        unknown_ingredient_ids = unique_ingredient_id_list.difference(
+            Ingredient.objects.filter(pk__in=unique_ingredient_id_list)
+            .values_list('pk', flat=True)
+        )
+        if unknown_ingredient_ids:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: '
+                f'{", ".join(map(str, sorted(unknown_ingredient_ids)))}.'
+            )
         return obj
 
     def ingredients_and_tags_set(self, recipe, tags, ingredients):
+        """Записывает теги и ингредиенты, меняя только отличающиеся строки.
+
+        Возвращает id удалённых, добавленных и изменённых ингредиентов:
+        сигналы пересчёта списков покупок не срабатывают ни для одной
+        из этих записей, и вызывающий код пересчитывает списки один раз.
+        """
         recipe.tags.set(tags)
-        ingredient_list = []
-        for ingredient in ingredients:
-            ingredient_list.append(
+        quantities = {
+            ingredient['id']: ingredient['quantity']
+            for ingredient in ingredients
+        }
+        current = {
+            ingredient_recipe.ingredient_id: ingredient_recipe
+            for ingredient_recipe in recipe.ingredient_recipes.all()
+        }
+        removed = current.keys() - quantities.keys()
+        updated = []
+        for ingredient_id, ingredient_recipe in current.items():
+            quantity = quantities.get(ingredient_id)
+            if quantity is not None and ingredient_recipe.quantity != quantity:
+                ingredient_recipe.quantity = quantity
+                updated.append(ingredient_id)
+        added = quantities.keys() - current.keys()
+        if removed:
+            with per_row_refresh_paused():
+                IngredientRecipe.objects.filter(
+                    recipe=recipe, ingredient__in=removed
+                ).delete()
+        if updated:
+            IngredientRecipe.objects.bulk_update(
+                [current[ingredient_id] for ingredient_id in updated],
+                ['quantity']
+            )
+        if added:
+            IngredientRecipe.objects.bulk_create(
                 IngredientRecipe(
                     recipe=recipe,
-                    ingredient=Ingredient.objects.get(pk=ingredient['id']),
-                    quantity=ingredient['quantity']
+                    ingredient_id=ingredient_id,
+                    quantity=quantities[ingredient_id]
                 )
+                for ingredient_id in added
+            )
+        changed = removed | added | set(updated)
+        if changed:
+            transaction.on_commit(
+                partial(bump_versions, IngredientRecipe._meta.db_table)
             )
-        IngredientRecipe.objects.bulk_create(ingredient_list)
+        return changed
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(
-            author=self.context['request'].user,
-            **validated_data
-        )
+        with per_row_refresh_paused():
+            recipe = Recipe.objects.create(
+                author=self.context['request'].user,
+                tags_mask=get_tags_mask(tags),
+                **validated_data
+            )
         self.ingredients_and_tags_set(recipe, tags, ingredients)
+        # Состав записан через bulk_create, сигналы его не видят.
+        Recipe.objects.filter(pk=recipe.pk).update_search_vector()
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         instance.image = validated_data.get('image', instance.image)
         instance.name = validated_data.get('name', instance.name)
@@ -334,14 +418,23 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time)
         tags = validated_data.pop('tags')
+        instance.tags_mask = get_tags_mask(tags)
         ingredients = validated_data.pop('ingredients')
-        IngredientRecipe.objects.filter(
-            recipe=instance,
-            ingredient__in=instance.ingredients.all()).delete()
-        self.ingredients_and_tags_set(instance, tags, ingredients)
+        changed_ingredients = self.ingredients_and_tags_set(
+            instance, tags, ingredients
+        )
+        # search_vector пересчитывает post_save уже по новому составу.
         instance.save()
+        if changed_ingredients:
+            ShoppingListItem.objects.refresh(
+                ShoppingCart.objects.filter(recipe=instance).values('user'),
+                changed_ingredients
+            )
         return instance
 
     def to_representation(self, instance):
+        instance = Recipe.objects.for_read(
+            self.context['request'].user
+        ).get(pk=instance.pk)
         return RecipeReadSerializer(instance,
                                     context=self.context).data
@@ -0,0 +1,196 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from foodgram.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                             ShoppingCart, ShoppingListItem, Tag)
+from users.models import Follow, User
+
+from .cache import bump_versions
+
+refresh_paused = ContextVar('refresh_paused', default=False)
+
+VERSIONED_MODELS = (
+    Recipe, Favorite, ShoppingCart, Follow, User, Ingredient, Tag,
+    IngredientRecipe,
+)
+
+
+def invalidate_table(sender, **kwargs):
+    """Сбрасывает версию таблицы после коммита.
+
+    Иначе параллельный запрос успел бы закэшировать данные
+    до коммита под уже новой версией.
+    """
+    transaction.on_commit(partial(bump_versions, sender._meta.db_table))
+
+
+for model in VERSIONED_MODELS:
+    post_save.connect(invalidate_table, sender=model)
+    post_delete.connect(invalidate_table, sender=model)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    """Пересчитывает tags_mask после recipe.tags и tag.recipes.
+
+    При tag.recipes.clear() pk_set пуст, поэтому рецепты тега
+    запоминаются до удаления связей.
+    """
+    if action == 'pre_clear' and reverse:
+        instance.cleared_recipes = list(
+            Recipe.objects.filter(tags=instance).values_list('pk', flat=True)
+        )
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        recipes = [instance.pk]
+    elif action == 'post_clear':
+        recipes = instance.__dict__.pop('cleared_recipes', [])
+    else:
+        recipes = pk_set
+    if recipes:
+        Recipe.objects.filter(pk__in=recipes).update_tags_mask()
+        invalidate_table(Recipe)
+    invalidate_table(sender)
+
+
+@receiver(pre_delete, sender=Recipe)
+def refresh_shopping_lists(sender, instance, **kwargs):
+    """Удалённый рецепт пропадает из списков покупок после коммита."""
+    users = list(
+        ShoppingCart.objects.filter(recipe=instance)
+        .values_list('user_id', flat=True)
+    )
+    if users:
+        transaction.on_commit(
+            partial(ShoppingListItem.objects.refresh, users)
+        )
+
+
+@contextmanager
+def per_row_refresh_paused():
+    """Отключает пересчёт на каждую записанную строку.
+
+    Касается списков покупок и search_vector рецептов. Каскадное
+    удаление рецепта или пользователя иначе пересчитывало бы их
+    на каждую строку корзины и состава. Списки пользователей,
+    у которых в корзине удалённые рецепты, пересчитывает после коммита
+    refresh_shopping_lists; остальные изменения внутри паузы вызывающий
+    код пересчитывает сам.
+    """
+    token = refresh_paused.set(True)
+    try:
+        yield
+    finally:
+        refresh_paused.reset(token)
+
+
+@receiver(pre_save, sender=ShoppingCart)
+@receiver(pre_save, sender=IngredientRecipe)
+def remember_previous_state(sender, instance, raw, **kwargs):
+    """Запоминает строку до изменения.
+
+    Если в админке сменили рецепт или пользователя, пересчитывать
+    нужно и прежний список покупок.
+    """
+    instance.previous_state = None
+    if instance.pk is not None and not raw and not refresh_paused.get():
+        instance.previous_state = (
+            sender.objects.filter(pk=instance.pk).first()
+        )
+
+
+def get_affected_rows(instance, signal):
+    rows = [instance]
+    if signal is post_save:
+        previous = getattr(instance, 'previous_state', None)
+        if previous is not None:
+            rows.append(previous)
+    return rows
+
+
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def refresh_cart_shopping_list(sender, instance, signal, **kwargs):
+    """Список покупок следует за корзиной при записи через ORM.
+
+    Представления API меняют корзину сырым SQL и bulk_create
+    и пересчитывают список сами.
+    """
+    if kwargs.get('raw') or refresh_paused.get():
+        return
+    rows = get_affected_rows(instance, signal)
+    ShoppingListItem.objects.refresh(
+        {row.user_id for row in rows},
+        IngredientRecipe.objects
+        .filter(recipe_id__in={row.recipe_id for row in rows})
+        .values('ingredient_id')
+    )
+
+
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def refresh_recipe_shopping_lists(sender, instance, signal, **kwargs):
+    """Изменённый состав рецепта попадает в списки покупок с ним."""
+    if kwargs.get('raw') or refresh_paused.get():
+        return
+    rows = get_affected_rows(instance, signal)
+    users = list(
+        ShoppingCart.objects
+        .filter(recipe_id__in={row.recipe_id for row in rows})
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
+    if users:
+        ShoppingListItem.objects.refresh(
+            users, {row.ingredient_id for row in rows}
+        )
+
+
+@receiver(pre_delete, sender=Tag)
+def clear_tag_bit(sender, instance, **kwargs):
+    """Бит удаляемого тега снимается с рецептов и достанется новому тегу."""
+    if instance.mask:
+        Recipe.objects.filter(tags=instance).update(
+            tags_mask=F('tags_mask').bitand(~instance.mask)
+        )
+        invalidate_table(Recipe)
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_vector(sender, instance, raw, update_fields, **kwargs):
+    """search_vector следует за названием и описанием рецепта."""
+    if raw or refresh_paused.get():
+        return
+    if update_fields is not None and not {'name', 'text'} & update_fields:
+        return
+    Recipe.objects.filter(pk=instance.pk).update_search_vector()
+
+
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def update_composition_search_vector(sender, instance, signal, **kwargs):
+    """Поиск по рецептам видит изменённый через ORM состав.
+
+    bulk_create и bulk_update сигналы не отправляют: после них
+    update_search_vector вызывает сам пишущий код.
+    """
+    if kwargs.get('raw') or refresh_paused.get():
+        return
+    Recipe.objects.filter(pk__in={
+        row.recipe_id for row in get_affected_rows(instance, signal)
+    }).update_search_vector()
+
+
+@receiver(post_save, sender=Ingredient)
+def update_recipes_search_vector(sender, instance, created, **kwargs):
+    """Переименованный ингредиент находится в поиске по рецептам."""
+    if not created:
+        Recipe.objects.filter(ingredients=instance).update_search_vector()
@@ -0,0 +1,956 @@
+import base64
+import gzip
+import tempfile
+from io import StringIO
+from unittest import mock, skipUnless
+
+from backend_foodgram.nplusone import NPlusOneError, detect_n_plus_one
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from foodgram.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                             ShoppingCart, ShoppingListItem,
+                             ShoppingListItemQuerySet, Tag)
+from rest_framework.serializers import BaseSerializer
+from rest_framework.test import APIClient, APIRequestFactory
+from users.models import Follow, User
+
+from .cache import get_versions
+from .pagination import CountStrategyPaginator, CustomPagination
+from .search import IndexIngredientSearch, PythonRecipeSearch
+from .serializers import BATCH_MAX_SIZE, RecipeReadSerializer
+
+# PNG 1x1.
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=='
+)
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+# Загруженные в тестах картинки не должны попадать в MEDIA_ROOT проекта.
+media_root = None
+media_settings = None
+
+
+def setUpModule():
+    global media_root, media_settings
+    media_root = tempfile.TemporaryDirectory()
+    media_settings = override_settings(MEDIA_ROOT=media_root.name)
+    media_settings.enable()
+
+
+def tearDownModule():
+    media_settings.disable()
+    media_root.cleanup()
+
+
+def create_user(username, **fields):
+    return User.objects.create_user(**{
+        'username': username, 'email': f'{username}@example.com',
+        'password': 'pass', 'first_name': 'Имя', 'last_name': 'Фамилия',
+        **fields,
+    })
+
+
+def create_tag(slug='lunch', name='Обед', color='#49B64E'):
+    return Tag.objects.create(name=name, slug=slug, color=color)
+
+
+def create_recipe(author, name='Суп', ingredients=(), quantity=1, tags=(),
+                  **fields):
+    """Рецепт с тегами tags и составом из ingredients по quantity.
+
+    Состав пишется одним bulk_create, как в RecipeCreateSerializer,
+    поэтому search_vector пересчитывается здесь же.
+    """
+    recipe = Recipe.objects.create(**{
+        'author': author, 'name': name, 'text': 'Описание',
+        'image': 'recipes/test.png', 'cooking_time': 10, **fields,
+    })
+    recipe.tags.add(*tags)
+    if ingredients:
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe, ingredient=ingredient, quantity=quantity
+            )
+            for ingredient in ingredients
+        )
+        Recipe.objects.filter(pk=recipe.pk).update_search_vector()
+    return recipe
+
+
+def get_client(user=None):
+    client = APIClient()
+    if user is not None:
+        client.force_authenticate(user)
+    return client
+
+
+@override_settings(CACHES=TEST_CACHES)
+class FoodgramTestCase(TestCase):
+    """Тесты с кэшем в памяти, пустым к началу каждого теста."""
+
+    def setUp(self):
+        cache.clear()
+
+
+@mock.patch.object(CustomPagination, 'count_strategy', 'exact')
+class RecipeReadQueriesTest(FoodgramTestCase):
+    """Число запросов списка и карточки рецепта не зависит от данных."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.user = create_user('reader')
+        tag = create_tag()
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {index}', measurement_unit='г')
+            for index in range(30)
+        )
+        ingredients = list(Ingredient.objects.order_by('pk'))
+        cls.small = create_recipe(
+            cls.author, 'Суп', ingredients[:1], tags=[tag]
+        )
+        cls.large = create_recipe(cls.author, 'Рагу', ingredients, tags=[tag])
+
+    def setUp(self):
+        super().setUp()
+        self.client = get_client(self.user)
+
+    def test_list(self):
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(len(recipe['ingredients'])
+                   for recipe in response.data['results']),
+            [1, 30]
+        )
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_profiling_serializer_timing(self):
+        data = BaseSerializer.data
+        with self.assertLogs('backend_foodgram.profiling', 'INFO'):
+            response = self.client.get('/api/recipes/')
+        timings = dict(
+            metric.split(';')[:2]
+            for metric in response['Server-Timing'].split(', ')
+        )
+        self.assertGreater(float(timings['serializer'][4:]), 0)
+        self.assertIs(BaseSerializer.data, data)
+
+    def test_detail(self):
+        for recipe, count in ((self.small, 1), (self.large, 30)):
+            with self.subTest(ingredients=count):
+                with self.assertNumQueries(4):
+                    response = self.client.get(f'/api/recipes/{recipe.pk}/')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['ingredients']), count)
+
+
+@mock.patch.object(CustomPagination, 'count_strategy', 'exact')
+class KeysetPaginationTest(FoodgramTestCase):
+    """Курсорная выдача проходит все строки без повторов и COUNT."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        recipes = [
+            create_recipe(cls.author, f'Рецепт {index}') for index in range(8)
+        ]
+        # Одинаковые даты на границе страниц: позицию различает только pk.
+        Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe in recipes[:4]]
+        ).update(pub_date=recipes[0].pub_date)
+        cls.expected = list(
+            Recipe.objects.order_by('-pub_date', '-pk')
+            .values_list('pk', flat=True)
+        )
+
+    def test_pages(self):
+        client = get_client()
+        response = client.get('/api/recipes/', {'pagination': 'cursor'})
+        pages = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            pages.append([recipe['id'] for recipe in response.data['results']])
+            if response.data['next'] is None:
+                break
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(response.data['next'])
+            self.assertFalse(any(
+                'COUNT(' in query['sql'] for query in queries.captured_queries
+            ))
+        self.assertEqual(
+            [len(page) for page in pages], [CustomPagination.page_size, 2]
+        )
+        self.assertEqual(sum(pages, []), self.expected)
+
+    def test_users(self):
+        create_user('reader')
+        response = get_client().get(
+            '/api/users/', {'pagination': 'cursor'}
+        )
+        self.assertEqual(
+            [user['username'] for user in response.data['results']],
+            ['author', 'reader']
+        )
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        for cursor in ('abc', base64.urlsafe_b64encode(b'[1]').decode(),
+                       base64.urlsafe_b64encode(b'["day", 1]').decode()):
+            with self.subTest(cursor=cursor):
+                response = get_client().get(
+                    '/api/recipes/', {'cursor': cursor}
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+class CountStrategyTest(FoodgramTestCase):
+    """Способы подсчёта count постраничной выдачи."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        for name in ('Суп', 'Пирог', 'Плов'):
+            create_recipe(cls.author, name)
+
+    def get_count(self, queryset, strategy, threshold=100000):
+        return CountStrategyPaginator(
+            queryset, CustomPagination.page_size, strategy=strategy,
+            estimate_threshold=threshold
+        ).count
+
+    def test_exact(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_count(Recipe.objects.all(), 'exact'), 3)
+            self.assertEqual(self.get_count(Recipe.objects.all(), 'exact'), 3)
+
+    def test_cached(self):
+        queryset = Recipe.objects.all()
+        self.assertEqual(self.get_count(queryset, 'cached'), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_count(queryset, 'cached'), 3)
+        self.assertEqual(
+            self.get_count(queryset.filter(name='Суп'), 'cached'), 1
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            create_recipe(self.author, 'Рагу')
+        self.assertEqual(self.get_count(queryset, 'cached'), 4)
+        self.assertEqual(self.get_count(queryset.none(), 'cached'), 0)
+
+    def test_estimated(self):
+        queryset = Recipe.objects.all()
+        self.assertEqual(self.get_count(queryset, 'estimated'), 3)
+        with mock.patch.object(CountStrategyPaginator, 'get_estimate',
+                               return_value=500000):
+            self.assertEqual(self.get_count(queryset, 'estimated'), 500000)
+            self.assertEqual(
+                self.get_count(queryset, 'estimated', threshold=10 ** 6), 3
+            )
+            self.assertEqual(
+                self.get_count(queryset.filter(name='Суп'), 'estimated'), 1
+            )
+
+    def test_api(self):
+        for strategy in ('exact', 'cached', 'estimated'):
+            with self.subTest(strategy=strategy), mock.patch.object(
+                CustomPagination, 'count_strategy', strategy
+            ):
+                response = get_client().get('/api/recipes/')
+                self.assertEqual(response.data['count'], 3)
+
+
+class SubscribeTest(FoodgramTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.author = create_user('author')
+
+    def setUp(self):
+        super().setUp()
+        self.client = get_client(self.user)
+
+    def test_subscribe_once(self):
+        path = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(self.client.post(path).status_code, 201)
+        self.assertEqual(self.client.post(path).status_code, 400)
+        self.assertEqual(
+            Follow.objects.filter(user=self.user, author=self.author).count(),
+            1
+        )
+
+    def test_invalid_recipes_limit_does_not_subscribe(self):
+        path = f'/api/users/{self.author.pk}/subscribe/'
+        response = self.client.post(f'{path}?recipes_limit=abc')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Follow.objects.exists())
+        response = self.client.post(f'{path}?recipes_limit=2')
+        self.assertEqual(response.status_code, 201)
+
+    def test_subscribe_to_self(self):
+        response = self.client.post(f'/api/users/{self.user.pk}/subscribe/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Follow.objects.exists())
+
+
+class BatchTest(FoodgramTestCase):
+    """Пакетные запросы отдают статус для каждого id."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.author = create_user('author')
+        cls.salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        cls.soup = create_recipe(cls.author, 'Суп', [cls.salt], quantity=2)
+        cls.cake = create_recipe(cls.author, 'Пирог', [cls.salt], quantity=3)
+        cls.missing = cls.cake.pk + 100
+
+    def setUp(self):
+        super().setUp()
+        self.client = get_client(self.user)
+
+    def send(self, method, path, ids):
+        response = getattr(self.client, method)(
+            path, {'ids': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [(row['id'], row['status']) for row in response.data['results']]
+
+    def test_recipes(self):
+        soup, cake, missing = self.soup.pk, self.cake.pk, self.missing
+        for action, model in (
+            ('favorite', Favorite), ('shopping_cart', ShoppingCart)
+        ):
+            with self.subTest(action=action):
+                path = f'/api/recipes/{action}/batch/'
+                self.assertEqual(
+                    self.send('post', path, [soup, missing, soup]),
+                    [(soup, 201), (missing, 404)]
+                )
+                self.assertEqual(
+                    self.send('post', path, [cake, soup]),
+                    [(cake, 201), (soup, 200)]
+                )
+                self.assertEqual(
+                    model.objects.filter(user=self.user).count(), 2
+                )
+                self.assertEqual(
+                    self.send('delete', path, [soup, missing, cake]),
+                    [(soup, 204), (missing, 404), (cake, 204)]
+                )
+                self.assertFalse(model.objects.exists())
+
+    def test_shopping_list(self):
+        path = '/api/recipes/shopping_cart/batch/'
+        self.send('post', path, [self.soup.pk, self.cake.pk])
+        self.assertEqual(
+            ShoppingListItem.objects.get(user=self.user).total_quantity, 5
+        )
+        self.send('delete', path, [self.cake.pk])
+        self.assertEqual(
+            ShoppingListItem.objects.get(user=self.user).total_quantity, 2
+        )
+        call_command('rebuild_shopping_lists', verify=True, stdout=StringIO())
+
+    def test_subscriptions(self):
+        path = '/api/users/subscribe/batch/'
+        author, user, missing = self.author.pk, self.user.pk, self.missing
+        self.assertEqual(
+            self.send('post', path, [author, user, missing]),
+            [(author, 201), (user, 400), (missing, 404)]
+        )
+        self.assertEqual(self.send('post', path, [author]), [(author, 200)])
+        self.assertEqual(
+            self.send('delete', path, [author, missing]),
+            [(author, 204), (missing, 404)]
+        )
+        self.assertFalse(Follow.objects.exists())
+
+    def test_invalid_ids(self):
+        for ids in ([], ['abc'], [0], list(range(1, BATCH_MAX_SIZE + 2))):
+            with self.subTest(ids=len(ids)):
+                response = self.client.post(
+                    '/api/recipes/favorite/batch/', {'ids': ids},
+                    format='json'
+                )
+                self.assertEqual(response.status_code, 400)
+        response = get_client().post(
+            '/api/recipes/favorite/batch/', {'ids': [self.soup.pk]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(Favorite.objects.exists())
+
+
+class InvalidateOnCommitTest(FoodgramTestCase):
+
+    def test_version_bumped_after_commit(self):
+        table = Tag._meta.db_table
+        version = get_versions(table)[table]
+        with self.captureOnCommitCallbacks(execute=True):
+            create_tag('dinner', 'Ужин', '#8775D2')
+            self.assertEqual(get_versions(table)[table], version)
+        self.assertNotEqual(get_versions(table)[table], version)
+
+    def test_recipe_update_bumps_ingredients_after_commit(self):
+        author = create_user('author')
+        tag = create_tag()
+        ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        recipe = create_recipe(author, 'Суп', [ingredient], tags=[tag])
+        table = IngredientRecipe._meta.db_table
+        version = get_versions(table)[table]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = get_client(author).patch(
+                f'/api/recipes/{recipe.pk}/',
+                {
+                    'name': 'Суп', 'text': 'Описание', 'cooking_time': 10,
+                    'image': IMAGE, 'tags': [tag.pk],
+                    'ingredients': [{'id': ingredient.pk, 'amount': 5}],
+                },
+                format='json'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(get_versions(table)[table], version)
+        self.assertNotEqual(get_versions(table)[table], version)
+
+
+class ResponseCacheTest(FoodgramTestCase):
+    """Справочники отвечают 304 из кэша, пока не изменились их таблицы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = create_tag()
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+
+    def assertNotModified(self, path, change):
+        client = get_client()
+        etag = client.get(path)['ETag']
+        with self.assertNumQueries(0):
+            response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response.json()
+
+    def test_tags(self):
+        data = self.assertNotModified(
+            '/api/tags/', lambda: create_tag('dinner', 'Ужин', '#8775D2')
+        )
+        self.assertEqual(len(data), 2)
+
+        def rename():
+            self.tag.name = 'Ланч'
+            self.tag.save()
+
+        data = self.assertNotModified(f'/api/tags/{self.tag.pk}/', rename)
+        self.assertEqual(data['name'], 'Ланч')
+
+    def test_ingredients(self):
+        data = self.assertNotModified(
+            '/api/ingredients/?name=с',
+            lambda: Ingredient.objects.create(
+                name='сахар', measurement_unit='г'
+            )
+        )
+        self.assertEqual([item['name'] for item in data], ['сахар', 'соль'])
+
+    def test_gzip(self):
+        client = get_client()
+        plain = client.get('/api/tags/')
+        compressed = client.get('/api/tags/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed['ETag'], plain['ETag'])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+
+
+class ShoppingListSignalsTest(FoodgramTestCase):
+    """Запись корзины и состава рецепта через ORM пересчитывает списки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.user = create_user('reader')
+        cls.salt, cls.sugar = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'сахар')
+        )
+        cls.soup = create_recipe(cls.author, 'Суп', [cls.salt], quantity=5)
+        cls.cake = create_recipe(
+            cls.author, 'Пирог', [cls.sugar], quantity=100
+        )
+
+    def assertShoppingList(self, user, expected):
+        self.assertEqual(
+            dict(ShoppingListItem.objects.filter(user=user).values_list(
+                'ingredient', 'total_quantity'
+            )),
+            expected
+        )
+        call_command('rebuild_shopping_lists', verify=True, stdout=StringIO())
+
+    def test_cart_changes(self):
+        cart = ShoppingCart.objects.create(user=self.user, recipe=self.soup)
+        self.assertShoppingList(self.user, {self.salt.pk: 5})
+        cart.recipe = self.cake
+        cart.save()
+        self.assertShoppingList(self.user, {self.sugar.pk: 100})
+        cart.user = self.author
+        cart.save()
+        self.assertShoppingList(self.user, {})
+        self.assertShoppingList(self.author, {self.sugar.pk: 100})
+        cart.delete()
+        self.assertShoppingList(self.author, {})
+
+    def test_recipe_ingredient_changes(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.soup)
+        row = IngredientRecipe.objects.get(recipe=self.soup)
+        row.quantity = 7
+        row.save()
+        self.assertShoppingList(self.user, {self.salt.pk: 7})
+        row.ingredient = self.sugar
+        row.save()
+        self.assertShoppingList(self.user, {self.sugar.pk: 7})
+        IngredientRecipe.objects.create(
+            recipe=self.soup, ingredient=self.salt, quantity=3
+        )
+        self.assertShoppingList(self.user, {self.salt.pk: 3, self.sugar.pk: 7})
+        IngredientRecipe.objects.filter(recipe=self.soup).delete()
+        self.assertShoppingList(self.user, {})
+
+
+class ShoppingListRefreshQueriesTest(FoodgramTestCase):
+    """Число запросов удаления и правки рецепта не зависит от корзин."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        User.objects.bulk_create(
+            User(username=f'reader{index}',
+                 email=f'reader{index}@example.com',
+                 first_name='Имя', last_name='Фамилия')
+            for index in range(10)
+        )
+        cls.users = list(
+            User.objects.filter(username__startswith='reader')
+            .order_by('pk')
+        )
+        cls.tag = create_tag()
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {index}', measurement_unit='г')
+            for index in range(8)
+        )
+        cls.ingredients = list(Ingredient.objects.order_by('pk'))
+
+    def setUp(self):
+        super().setUp()
+        self.client = get_client(self.author)
+
+    def create_recipe(self, carts):
+        recipe = create_recipe(
+            self.author, 'Суп', self.ingredients, quantity=2, tags=[self.tag]
+        )
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=user, recipe=recipe)
+            for user in self.users[:carts]
+        )
+        ShoppingListItem.objects.refresh([user.pk for user in self.users])
+        return recipe
+
+    def count_queries(self, method, recipe, data=None):
+        with CaptureQueriesContext(connection) as queries, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(
+                f'/api/recipes/{recipe.pk}/', data, format='json'
+            )
+        self.assertLess(response.status_code, 300)
+        call_command('rebuild_shopping_lists', verify=True, stdout=StringIO())
+        return len(queries)
+
+    def test_destroy(self):
+        self.assertEqual(
+            self.count_queries('delete', self.create_recipe(carts=2)),
+            self.count_queries('delete', self.create_recipe(carts=10))
+        )
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_update_removing_ingredients(self):
+        data = {
+            'name': 'Суп', 'text': 'Описание', 'cooking_time': 10,
+            'image': IMAGE, 'tags': [self.tag.pk],
+            'ingredients': [{'id': self.ingredients[0].pk, 'amount': 3}],
+        }
+        self.assertEqual(
+            self.count_queries('patch', self.create_recipe(carts=2), data),
+            self.count_queries('patch', self.create_recipe(carts=10), data)
+        )
+        self.assertEqual(
+            ShoppingListItem.objects.get(user=self.users[0]).total_quantity,
+            6
+        )
+        recipe = self.create_recipe(carts=10)
+        refresh = ShoppingListItemQuerySet.refresh
+        with mock.patch.object(ShoppingListItemQuerySet, 'refresh',
+                               autospec=True, side_effect=refresh) as spy:
+            self.count_queries('patch', recipe, data)
+        self.assertEqual(spy.call_count, 1)
+
+
+class RecipeIngredientsValidationTest(FoodgramTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tag = create_tag()
+        cls.salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+
+    def test_unknown_ingredients(self):
+        client = get_client(self.author)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post('/api/recipes/', {
+                'name': 'Суп', 'text': 'Описание', 'cooking_time': 10,
+                'image': IMAGE, 'tags': [self.tag.pk],
+                'ingredients': [
+                    {'id': self.salt.pk, 'amount': 1},
+                    {'id': self.salt.pk + 100, 'amount': 1},
+                ],
+            }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.salt.pk + 100), str(response.data))
+        table = Ingredient._meta.db_table
+        lookups = [
+            query['sql'] for query in queries.captured_queries
+            if f'FROM "{table}"' in query['sql']
+        ]
+        self.assertEqual(len(lookups), 1)
+        self.assertNotIn('measurement_unit', lookups[0])
+        self.assertFalse(Recipe.objects.exists())
+
+
+@mock.patch.object(CustomPagination, 'count_strategy', 'exact')
+class SearchVectorSignalsTest(FoodgramTestCase):
+    """Поиск по рецептам видит изменения, сделанные через ORM."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.saffron = Ingredient.objects.create(
+            name='шафран', measurement_unit='г'
+        )
+
+    def assertFound(self, change, query, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.client.get('/api/recipes/', {'q': query})
+        self.assertEqual(response.data['count'], count)
+
+    def test_orm_writes(self):
+        recipe = Recipe(
+            author=self.author, name='Плов', text='Описание',
+            image='recipes/test.png', cooking_time=10
+        )
+        self.assertFound(recipe.save, 'плов', 1)
+        recipe.name = 'Ризотто'
+        self.assertFound(recipe.save, 'ризотто', 1)
+        row = IngredientRecipe(
+            recipe=recipe, ingredient=self.saffron, quantity=1
+        )
+        self.assertFound(row.save, 'шафран', 1)
+        self.assertFound(row.delete, 'шафран', 0)
+
+
+@mock.patch.object(CustomPagination, 'count_strategy', 'exact')
+class RecipeSearchTest(FoodgramTestCase):
+    """Поиск по рецептам: все слова запроса, совпадения в названии выше.
+
+    Через API ищет бэкенд текущей базы, PythonRecipeSearch
+    проверяется и отдельно, так как на PostgreSQL он не вызывается.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        chicken, rice = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('курица', 'рис')
+        )
+        cls.soup = create_recipe(author, 'Суп с курицей', [chicken])
+        cls.pilaf = create_recipe(author, 'Плов', [chicken, rice])
+        cls.porridge = create_recipe(
+            author, 'Каша', [rice], text='Рисовая каша на молоке'
+        )
+
+    def search(self, query):
+        response = get_client().get('/api/recipes/', {'q': query})
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def python_search(self, query):
+        return list(
+            PythonRecipeSearch()
+            .search(Recipe.objects.all(), query)
+            .values_list('pk', flat=True)
+        )
+
+    def test_search(self):
+        for search in (self.search, self.python_search):
+            with self.subTest(search=search.__name__):
+                expected = [self.soup.pk, self.pilaf.pk]
+                self.assertEqual(search('курица'), expected)
+                self.assertEqual(search('КУРИЦЕЙ'), expected)
+                self.assertEqual(search('плов рис'), [self.pilaf.pk])
+                self.assertEqual(
+                    set(search('рис')), {self.pilaf.pk, self.porridge.pk}
+                )
+                self.assertEqual(search('макароны'), [])
+
+
+class IngredientSearchTest(FoodgramTestCase):
+    """Поиск ингредиентов по началу названия и нечёткий."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('молоко', 'молотый перец', 'мёд', 'мука'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def search(self, name, **params):
+        response = get_client().get(
+            '/api/ingredients/', {'name': name, **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.json()]
+
+    def test_prefix(self):
+        self.assertEqual(self.search('мол'), ['молоко', 'молотый перец'])
+        self.assertEqual(self.search('МЕ'), ['мёд'])
+        self.assertEqual(self.search('мё', fuzzy=1), ['мёд'])
+        self.assertEqual(self.search('рис'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Мёд липовый', measurement_unit='г')
+        self.assertEqual(self.search('мед'), ['мёд', 'Мёд липовый'])
+
+    def test_fuzzy(self):
+        self.assertEqual(
+            self.search('мол', fuzzy=1)[:2], ['молоко', 'молотый перец']
+        )
+        for names in (
+            self.search('молако', fuzzy=1),
+            [item['name'] for item in IndexIngredientSearch().search(
+                'молако', 20
+            )],
+        ):
+            with self.subTest(names=names):
+                self.assertEqual(names[0], 'молоко')
+                self.assertNotIn('мука', names)
+
+
+class ShoppingCartSummaryETagTest(FoodgramTestCase):
+    """ETag сводки корзины меняется только вместе с корзиной владельца."""
+
+    path = '/api/recipes/shopping_cart/summary/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.other = create_user('other')
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        cls.soup = create_recipe(cls.other, 'Суп', [salt])
+        cls.cake = create_recipe(cls.other, 'Пирог', [salt])
+
+    def setUp(self):
+        super().setUp()
+        self.client = get_client(self.user)
+        self.other_client = get_client(self.other)
+
+    def get_status(self, etag):
+        return self.client.get(self.path, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def change(self, client, method, recipe):
+        with self.captureOnCommitCallbacks(execute=True):
+            getattr(client, method)(f'/api/recipes/{recipe.pk}/shopping_cart/')
+
+    def test_etag(self):
+        self.change(self.client, 'post', self.soup)
+        etag = self.client.get(self.path)['ETag']
+        self.change(self.other_client, 'post', self.cake)
+        self.assertEqual(self.get_status(etag), 304)
+        self.change(self.client, 'post', self.cake)
+        self.assertEqual(self.get_status(etag), 200)
+        etag = self.client.get(self.path)['ETag']
+        row = IngredientRecipe.objects.get(recipe=self.soup)
+        row.quantity = 5
+        with self.captureOnCommitCallbacks(execute=True):
+            row.save()
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['ingredients'][0]['amount'], 6)
+
+
+class UserRecipeToggleTest(FoodgramTestCase):
+    """Добавление в избранное и корзину и удаление из них."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.recipe = create_recipe(
+            cls.user, 'Суп',
+            [Ingredient.objects.create(name='соль', measurement_unit='г')]
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client = get_client(self.user)
+
+    def test_toggle(self):
+        for action, model in (
+            ('favorite', Favorite), ('shopping_cart', ShoppingCart)
+        ):
+            with self.subTest(action=action):
+                path = f'/api/recipes/{self.recipe.pk}/{action}/'
+                response = self.client.post(path)
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response.data['name'], 'Суп')
+                self.assertEqual(response.data['cooking_time'], 10)
+                self.assertEqual(self.client.post(path).status_code, 200)
+                self.assertEqual(
+                    model.objects.filter(
+                        user=self.user, recipe=self.recipe
+                    ).count(),
+                    1
+                )
+                self.assertEqual(self.client.delete(path).status_code, 204)
+                self.assertEqual(self.client.delete(path).status_code, 404)
+                self.assertFalse(model.objects.exists())
+
+    def test_unknown_recipe(self):
+        for action in ('favorite', 'shopping_cart'):
+            for pk in (self.recipe.pk + 100, 'abc'):
+                with self.subTest(action=action, pk=pk):
+                    path = f'/api/recipes/{pk}/{action}/'
+                    self.assertEqual(self.client.post(path).status_code, 404)
+                    self.assertEqual(
+                        self.client.delete(path).status_code, 404
+                    )
+
+    @skipUnless(connection.vendor == 'postgresql',
+                'Один запрос только в ветке PostgreSQL.')
+    def test_single_statement(self):
+        path = f'/api/recipes/{self.recipe.pk}/favorite/'
+        for method in ('post', 'post', 'delete', 'delete'):
+            with self.subTest(method=method):
+                with self.assertNumQueries(1):
+                    getattr(self.client, method)(path)
+
+
+class DownloadShoppingCartErrorsTest(FoodgramTestCase):
+    """Ошибки выгрузки списка покупок отдаются в JSON."""
+
+    path = '/api/recipes/download_shopping_cart/'
+
+    def test_errors(self):
+        authenticated = get_client(create_user('reader'))
+        for client, method, query, code in (
+            (get_client(), 'get', '?format=pdf', 401),
+            (get_client(), 'get', '?format=txt', 401),
+            (authenticated, 'post', '?format=csv', 405),
+            (authenticated, 'get', '?format=xml', 404),
+        ):
+            with self.subTest(method=method, query=query):
+                response = getattr(client, method)(self.path + query)
+                self.assertEqual(response.status_code, code)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertIn('detail', response.json())
+        response = authenticated.get(self.path + '?format=pdf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+
+@mock.patch.object(CustomPagination, 'count_strategy', 'exact')
+class TagsMaskTest(FoodgramTestCase):
+    """Фильтр по тегам видит связи, заданные через ORM."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = create_tag()
+        cls.recipe = create_recipe(create_user('author'))
+
+    def assertCount(self, change, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.client.get('/api/recipes/?tags=lunch')
+        self.assertEqual(response.data['count'], count)
+
+    def test_recipe_tags(self):
+        self.assertCount(lambda: self.recipe.tags.add(self.tag), 1)
+        self.assertCount(lambda: self.recipe.tags.remove(self.tag), 0)
+        self.assertCount(lambda: self.recipe.tags.set([self.tag]), 1)
+        self.assertCount(self.recipe.tags.clear, 0)
+
+    def test_tag_recipes(self):
+        self.assertCount(lambda: self.tag.recipes.add(self.recipe), 1)
+        self.assertCount(self.tag.recipes.clear, 0)
+
+
+class NPlusOneTest(FoodgramTestCase):
+    """Основные выдачи не делают запрос на каждый объект."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        tags = [
+            create_tag(f'tag-{index}', f'Тег {index}', f'#00000{index}')
+            for index in range(2)
+        ]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {index}', measurement_unit='г')
+            for index in range(3)
+        )
+        ingredients = list(Ingredient.objects.order_by('pk'))
+        for index in range(10):
+            author = create_user(f'author{index}')
+            recipe = create_recipe(
+                author, f'Рецепт {index}', ingredients, quantity=index + 1,
+                tags=tags
+            )
+            Follow.objects.create(user=cls.user, author=author)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        super().setUp()
+        self.client = get_client(self.user)
+
+    def test_endpoints(self):
+        recipe = Recipe.objects.first()
+        for path in (
+            '/api/recipes/',
+            f'/api/recipes/{recipe.pk}/',
+            '/api/users/subscriptions/',
+            '/api/recipes/download_shopping_cart/',
+        ):
+            with self.subTest(path=path):
+                with detect_n_plus_one(2):
+                    response = self.client.get(path)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertEqual(response.status_code, 200)
+
+    def test_detects_unprefetched_recipes(self):
+        request = APIRequestFactory().get('/api/recipes/')
+        request.user = self.user
+        with self.assertRaises(NPlusOneError):
+            with detect_n_plus_one(2):
+                RecipeReadSerializer(
+                    Recipe.objects.all()[:10], many=True,
+                    context={'request': request}
+                ).data
@@ -1,27 +1,79 @@
-from django.db import IntegrityError
-from django.db.models import Sum
-from django.http import HttpResponse
+from backend_foodgram.profiling import ProfiledSerializerMixin
+from django.db import transaction
+from django.db.models import Count, Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from foodgram.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                             ShoppingCart, Tag)
+                             ShoppingCart, ShoppingListItem, Tag)
 from rest_framework import filters, mixins, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from users.models import Follow, User
 
+from .cache import (SHOPPING_CART_VERSION, bump_versions, cache_stream,
+                    get_cached, get_versions, make_key,
+                    versioned_response_cache)
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import CustomPagination
+from .ingredient_index import get_ingredient_index
+from .pagination import CustomPagination, PaginationModeMixin
 from .permissions import IsAuthorOrReadOnly
-from .serializers import (ChangePasswordSerializer, CustomUserCreateSerializer,
-                          FollowAuthorSerializer, FollowingListSerializer,
-                          IngredientSerializer, RecipeCreateSerializer,
-                          RecipeReadSerializer, RecipeSerializer,
+from .renderers import SHOPPING_LIST_RENDERERS
+from .search import search_ingredients
+from .serializers import (BatchSerializer, ChangePasswordSerializer,
+                          CustomUserCreateSerializer, FollowAuthorSerializer,
+                          FollowingListSerializer, IngredientSerializer,
+                          RecipeCreateSerializer, RecipeReadSerializer,
+                          RecipeSerializer, ShoppingListItemSerializer,
                           TagSerializer, UserReadSerializer)
+from .signals import per_row_refresh_paused
 
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60
+SHOPPING_LIST_CHUNK_SIZE = 500
 
-class UserViewSet(mixins.CreateModelMixin,
+
+def get_recipes_limit(request):
+    """Разбирает параметр recipes_limit из строки запроса."""
+    limit = request.query_params.get('recipes_limit')
+    if limit is None or limit == '':
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = -1
+    if limit < 0:
+        raise ValidationError(
+            {'recipes_limit': 'Укажите неотрицательное целое число.'}
+        )
+    return limit
+
+
+def get_batch_ids(request):
+    """Уникальные id из тела пакетного запроса в исходном порядке."""
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return list(dict.fromkeys(serializer.validated_data['ids']))
+
+
+def batch_response(ids, *groups, default=status.HTTP_404_NOT_FOUND):
+    """Ответ пакетного запроса: статус для каждого id.
+
+    groups - пары (множество id, статус); id, не попавший ни в одну
+    группу, получает статус default.
+    """
+    results = []
+    for pk in ids:
+        code = next((code for group, code in groups if pk in group), default)
+        results.append({'id': pk, 'status': code})
+    return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class UserViewSet(ProfiledSerializerMixin,
+                  PaginationModeMixin,
+                  mixins.CreateModelMixin,
                   mixins.ListModelMixin,
                   mixins.RetrieveModelMixin,
                   viewsets.GenericViewSet):
@@ -29,6 +81,11 @@ class UserViewSet(mixins.CreateModelMixin,
     permission_classes = (AllowAny,)
     pagination_class = CustomPagination
 
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return User.objects.with_is_subscribed(self.request.user)
+        return User.objects.all()
+
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
             return UserReadSerializer
@@ -38,7 +95,9 @@ class UserViewSet(mixins.CreateModelMixin,
             pagination_class=None,
             permission_classes=(IsAuthenticated,))
     def me(self, request):
-        serializer = UserReadSerializer(request.user)
+        self.start_serializer_timer()
+        serializer = UserReadSerializer(request.user,
+                                        context={'request': request})
         return Response(serializer.data,
                         status=status.HTTP_200_OK)
 
@@ -55,26 +114,48 @@ class UserViewSet(mixins.CreateModelMixin,
             permission_classes=(IsAuthenticated,),
             pagination_class=CustomPagination)
     def subscriptions(self, request):
-        queryset = User.objects.filter(following__user=request.user)
+        queryset = (
+            User.objects
+            .filter(following__user=request.user)
+            .annotate(recipes_quantity=Count('recipes'))
+            .order_by('id')
+            .prefetch_related(Prefetch(
+                'recipes',
+                queryset=Recipe.objects.latest_per_author(
+                    get_recipes_limit(request)
+                ),
+                to_attr='recipes_preview'
+            ))
+        )
         paginated_pages = self.paginate_queryset(queryset)
+        self.start_serializer_timer()
         serializer = FollowingListSerializer(
             paginated_pages,
             many=True,
-            context={'request': request}
+            context={'request': request, 'is_subscribed': True}
         )
         return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['post'],
             permission_classes=(IsAuthenticated,))
     def subscribe(self, request, **kwargs):
+        recipes_limit = get_recipes_limit(request)
         author = get_object_or_404(User, id=kwargs['pk'])
         serializer = FollowAuthorSerializer(
             author,
             data=request.data,
-            context={"request": request}
+            context={'request': request, 'is_subscribed': True}
         )
         serializer.is_valid(raise_exception=True)
-        Follow.objects.create(user=request.user, author=author)
+        _, created = Follow.objects.get_or_create(
+            user=request.user, author=author
+        )
+        if not created:
+            raise ValidationError('Вы уже подписаны на этого автора.')
+        author.recipes_preview, author.recipes_quantity = (
+            author.recipes.preview_with_total(recipes_limit)
+        )
+        self.start_serializer_timer()
         return Response(
             serializer.data,
             status=status.HTTP_201_CREATED
@@ -90,8 +171,30 @@ class UserViewSet(mixins.CreateModelMixin,
             status=status.HTTP_204_NO_CONTENT
         )
 
+    @action(detail=False, methods=['post'], url_path='subscribe/batch',
+            permission_classes=(IsAuthenticated,))
+    def subscribe_batch(self, request):
+        ids = get_batch_ids(request)
+        with transaction.atomic():
+            created, existing = Follow.objects.add_many(request.user, ids)
+        if created:
+            bump_versions(Follow._meta.db_table)
+        return batch_response(
+            ids,
+            (created, status.HTTP_201_CREATED),
+            (existing, status.HTTP_200_OK),
+            ({request.user.pk}, status.HTTP_400_BAD_REQUEST)
+        )
+
+    @subscribe_batch.mapping.delete
+    def unsubscribe_batch(self, request):
+        ids = get_batch_ids(request)
+        removed = Follow.objects.remove_many(request.user, ids)
+        return batch_response(ids, (removed, status.HTTP_204_NO_CONTENT))
 
-class IngredientViewSet(mixins.ListModelMixin,
+
+class IngredientViewSet(ProfiledSerializerMixin,
+                        mixins.ListModelMixin,
                         mixins.RetrieveModelMixin,
                         viewsets.GenericViewSet):
     queryset = Ingredient.objects.all()
@@ -102,8 +205,22 @@ class IngredientViewSet(mixins.ListModelMixin,
     filterset_class = IngredientFilter
     search_fields = ('^name',)
 
+    @versioned_response_cache(Ingredient)
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name and request.query_params.get('fuzzy') in ('1', 'true'):
+            return Response(search_ingredients(name))
+        if name is not None and len(request.query_params) == 1:
+            return Response(get_ingredient_index().startswith(name))
+        return super().list(request, *args, **kwargs)
+
+    @versioned_response_cache(Ingredient)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
-class TagViewSet(mixins.ListModelMixin,
+
+class TagViewSet(ProfiledSerializerMixin,
+                 mixins.ListModelMixin,
                  mixins.RetrieveModelMixin,
                  viewsets.GenericViewSet):
     queryset = Tag.objects.all()
@@ -111,42 +228,58 @@ class TagViewSet(mixins.ListModelMixin,
     serializer_class = TagSerializer
     pagination_class = None
 
+    @versioned_response_cache(Tag)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @versioned_response_cache(Tag)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(ProfiledSerializerMixin, PaginationModeMixin,
+                    viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     pagination_class = CustomPagination
     permission_classes = (IsAuthorOrReadOnly,)
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter,)
+    filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return Recipe.objects.for_read(self.request.user)
+        return Recipe.objects.all()
+
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
             return RecipeReadSerializer
         return RecipeCreateSerializer
 
+    def handle_exception(self, exc):
+        response = super().handle_exception(exc)
+        if self.renderer_classes == SHOPPING_LIST_RENDERERS:
+            # Ошибка выгрузки - JSON, а не файл в запрошенном формате.
+            self.request.accepted_renderer = JSONRenderer()
+            self.request.accepted_media_type = JSONRenderer.media_type
+        return response
+
+    def perform_destroy(self, instance):
+        # Списки покупок с этим рецептом пересчитываются один раз после
+        # коммита, а не на каждую удаляемую строку корзины и состава.
+        with per_row_refresh_paused():
+            instance.delete()
+
     @action(detail=True, methods=['post'],
             permission_classes=(IsAuthenticated,))
     def favorite(self, request, **kwargs):
-        recipe = get_object_or_404(Recipe, id=kwargs['pk'])
-        serializer = RecipeSerializer(
-            recipe,
-            data=request.data,
-            context={"request": request}
-        )
-        serializer.is_valid(raise_exception=True)
-        try:
-            favorite, created = Favorite.objects.get_or_create(
-                user=request.user,
-                recipe=recipe
-            )
-        except IntegrityError as e:
-            return Response(
-                {'detail': f'Произошла ошибка: {str(e)}'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        recipe, created = Favorite.objects.add(request.user, kwargs['pk'])
+        if recipe is None:
+            raise NotFound()
         if created:
+            bump_versions(Favorite._meta.db_table)
+            self.start_serializer_timer()
             return Response(
-                serializer.data,
+                RecipeSerializer(recipe, context={'request': request}).data,
                 status=status.HTTP_201_CREATED
             )
         return Response(
@@ -156,37 +289,54 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @favorite.mapping.delete
     def delete_from_favorite(self, request, **kwargs):
-        recipe = get_object_or_404(Recipe, id=kwargs['pk'])
-        get_object_or_404(Favorite, user=request.user,
-                          recipe=recipe).delete()
+        if not Favorite.objects.remove(request.user, kwargs['pk']):
+            raise NotFound()
+        bump_versions(Favorite._meta.db_table)
         return Response(
             {'detail': 'Рецепт успешно удален из избранного.'},
             status=status.HTTP_204_NO_CONTENT
         )
 
+    @action(detail=False, methods=['post'], url_path='favorite/batch',
+            permission_classes=(IsAuthenticated,))
+    def favorite_batch(self, request):
+        ids = get_batch_ids(request)
+        with transaction.atomic():
+            created, existing = Favorite.objects.add_many(request.user, ids)
+        if created:
+            bump_versions(Favorite._meta.db_table)
+        return batch_response(
+            ids,
+            (created, status.HTTP_201_CREATED),
+            (existing, status.HTTP_200_OK)
+        )
+
+    @favorite_batch.mapping.delete
+    def delete_from_favorite_batch(self, request):
+        ids = get_batch_ids(request)
+        removed = Favorite.objects.remove_many(request.user, ids)
+        if removed:
+            bump_versions(Favorite._meta.db_table)
+        return batch_response(ids, (removed, status.HTTP_204_NO_CONTENT))
+
     @action(detail=True, methods=['post'],
             permission_classes=(IsAuthenticated,))
     def shopping_cart(self, request, **kwargs):
-        recipe = get_object_or_404(Recipe, id=kwargs['pk'])
-        serializer = RecipeSerializer(
-            recipe,
-            data=request.data,
-            context={"request": request}
-        )
-        serializer.is_valid(raise_exception=True)
-        try:
-            shopping_cart, created = ShoppingCart.objects.get_or_create(
-                user=request.user,
-                recipe=recipe
-            )
-        except IntegrityError as e:
-            return Response(
-                {'detail': f'Произошла ошибка: {str(e)}'},
-                status=status.HTTP_400_BAD_REQUEST
+        with transaction.atomic():
+            recipe, created = ShoppingCart.objects.add(
+                request.user, kwargs['pk']
             )
+            if recipe is None:
+                raise NotFound()
+            if created:
+                ShoppingListItem.objects.refresh(
+                    [request.user.pk], recipe.ingredients.all()
+                )
         if created:
+            bump_versions(ShoppingCart._meta.db_table)
+            self.start_serializer_timer()
             return Response(
-                serializer.data,
+                RecipeSerializer(recipe, context={'request': request}).data,
                 status=status.HTTP_201_CREATED
             )
         return Response(
@@ -196,31 +346,118 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     @shopping_cart.mapping.delete
     def delete_from_shopping_cart(self, request, **kwargs):
-        recipe = get_object_or_404(Recipe, id=kwargs['pk'])
-        get_object_or_404(ShoppingCart, user=request.user,
-                          recipe=recipe).delete()
+        with transaction.atomic():
+            if not ShoppingCart.objects.remove(request.user, kwargs['pk']):
+                raise NotFound()
+            ShoppingListItem.objects.refresh(
+                [request.user.pk],
+                Ingredient.objects.filter(recipes__id=kwargs['pk'])
+            )
+        bump_versions(ShoppingCart._meta.db_table)
         return Response(
             {'detail': 'Рецепт успешно удален из списка покупок.'},
             status=status.HTTP_204_NO_CONTENT
         )
 
     @action(detail=False, methods=['get'],
+            url_path='shopping_cart/summary',
             permission_classes=(IsAuthenticated,))
-    def download_shopping_cart(self, request, **kwargs):
+    @versioned_response_cache(Ingredient, per_user=True,
+                              user_versions=(SHOPPING_CART_VERSION,))
+    def shopping_cart_summary(self, request, **kwargs):
+        recipes = list(
+            ShoppingCart.objects
+            .filter(user=request.user)
+            .order_by('recipe_id')
+            .values_list('recipe_id', flat=True)
+        )
         ingredients = (
-            IngredientRecipe.objects
-            .filter(recipe__shopping_cart__user=request.user)
-            .values('ingredient')
-            .annotate(total_quantity=Sum('quantity'))
-            .values_list('ingredient__name', 'total_quantity',
-                         'ingredient__measurement_unit')
-        )
-        file_with_ingredients = []
-        for ingredient in ingredients:
-            file_with_ingredients.append('{}: {} {}.'.format(*ingredient))
-        file = HttpResponse(
-            'Cписок покупок:\n' + '\n'.join(file_with_ingredients),
-            content_type='text/plain'
-        )
-        file['Content-Disposition'] = 'attachment; filename=shopping_cart.txt'
+            ShoppingListItem.objects
+            .filter(user=request.user)
+            .select_related('ingredient')
+            .order_by('ingredient__name')
+        )
+        self.start_serializer_timer()
+        return Response({
+            'recipes': recipes,
+            'recipes_count': len(recipes),
+            'ingredients': ShoppingListItemSerializer(
+                ingredients, many=True
+            ).data,
+        })
+
+    @action(detail=False, methods=['post'], url_path='shopping_cart/batch',
+            permission_classes=(IsAuthenticated,))
+    def shopping_cart_batch(self, request):
+        ids = get_batch_ids(request)
+        with transaction.atomic():
+            created, existing = ShoppingCart.objects.add_many(
+                request.user, ids
+            )
+            if created:
+                ShoppingListItem.objects.refresh(
+                    [request.user.pk],
+                    Ingredient.objects.filter(recipes__in=created)
+                )
+        if created:
+            bump_versions(ShoppingCart._meta.db_table)
+        return batch_response(
+            ids,
+            (created, status.HTTP_201_CREATED),
+            (existing, status.HTTP_200_OK)
+        )
+
+    @shopping_cart_batch.mapping.delete
+    def delete_from_shopping_cart_batch(self, request):
+        ids = get_batch_ids(request)
+        with transaction.atomic():
+            removed = ShoppingCart.objects.remove_many(request.user, ids)
+            if removed:
+                ShoppingListItem.objects.refresh(
+                    [request.user.pk],
+                    Ingredient.objects.filter(recipes__in=removed)
+                )
+        if removed:
+            bump_versions(ShoppingCart._meta.db_table)
+        return batch_response(ids, (removed, status.HTTP_204_NO_CONTENT))
+
+    @action(detail=False, methods=['get'],
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=SHOPPING_LIST_RENDERERS)
+    def download_shopping_cart(self, request, **kwargs):
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        recipes = sorted(
+            ShoppingCart.objects
+            .filter(user=request.user)
+            .values_list('recipe_id', flat=True)
+        )
+        versions = get_versions(
+            IngredientRecipe._meta.db_table, Ingredient._meta.db_table
+        )
+        key = make_key(
+            'shopping_list', renderer.format, recipes, sorted(versions.items())
+        )
+        content = get_cached(key)
+        if content is not None:
+            file = HttpResponse(content, content_type=content_type)
+        else:
+            ingredients = (
+                ShoppingListItem.objects
+                .filter(user=request.user)
+                .values_list('ingredient__name', 'total_quantity',
+                             'ingredient__measurement_unit')
+                .order_by('ingredient__name')
+                .iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)
+            )
+            file = StreamingHttpResponse(
+                cache_stream(renderer.stream(ingredients), key,
+                             SHOPPING_LIST_CACHE_TIMEOUT),
+                content_type=content_type
+            )
+        file['Content-Disposition'] = (
+            f'attachment; filename=shopping_cart.{renderer.format}'
+        )
         return file
@@ -0,0 +1,232 @@
+import atexit
+import glob
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+from .profiling import QueryTimer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PAGE_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+METRICS = {
+    'foodgram_http_requests_total': (
+        'counter', 'HTTP-запросы по view, методу и статусу ответа.'
+    ),
+    'foodgram_http_request_duration_seconds': (
+        'histogram', 'Время ответа по view и методу.'
+    ),
+    'foodgram_db_queries_total': (
+        'counter', 'SQL-запросы, выполненные при обработке view.'
+    ),
+    'foodgram_db_query_duration_seconds_total': (
+        'counter', 'Суммарное время SQL-запросов view.'
+    ),
+    'foodgram_cache_requests_total': (
+        'counter', 'Обращения к кэшу по типу записи: hit или miss.'
+    ),
+    'foodgram_pagination_page': (
+        'histogram', 'Номер запрошенной страницы списка.'
+    ),
+}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Registry:
+    """Метрики процесса, сбрасываемые в файл для сложения с другими.
+
+    Каждый воркер gunicorn пишет свои значения в отдельный файл каталога
+    METRICS_DIR не чаще раза в METRICS_FLUSH_INTERVAL секунд; /metrics
+    складывает все файлы. Все ряды аддитивны (гистограммы хранятся
+    накопленными корзинами), поэтому сумма по процессам корректна,
+    а файлы завершившихся воркеров продолжают учитываться в счётчиках.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = defaultdict(float)
+        self.pid = None
+        self.path = None
+        self.flushed = 0
+
+    @property
+    def directory(self):
+        return getattr(settings, 'METRICS_DIR', '')
+
+    def ensure_process(self):
+        """После fork значения родителя не должны попасть в файл воркера."""
+        if self.pid != os.getpid():
+            if self.pid is None:
+                atexit.register(self.flush, force=True)
+            self.pid = os.getpid()
+            self.path = os.path.join(
+                self.directory, f'{self.pid}-{uuid4().hex}.json'
+            )
+            self.values.clear()
+            self.flushed = time.monotonic()
+
+    def inc(self, name, value=1, **labels):
+        if not self.directory:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.ensure_process()
+            self.values[key] += value
+
+    def observe(self, name, value, buckets, **labels):
+        if not self.directory:
+            return
+        labels = tuple(sorted(labels.items()))
+        with self.lock:
+            self.ensure_process()
+            for bucket in (*buckets, math.inf):
+                if value <= bucket:
+                    le = '+Inf' if bucket == math.inf else str(bucket)
+                    self.values[(
+                        f'{name}_bucket', (*labels, ('le', le))
+                    )] += 1
+            self.values[(f'{name}_sum', labels)] += value
+            self.values[(f'{name}_count', labels)] += 1
+
+    def flush(self, force=False):
+        if not self.directory or self.pid != os.getpid():
+            return
+        with self.lock:
+            now = time.monotonic()
+            interval = settings.METRICS_FLUSH_INTERVAL
+            if not force and now - self.flushed < interval:
+                return
+            self.flushed = now
+            data = [
+                [name, dict(labels), value]
+                for (name, labels), value in self.values.items()
+            ]
+            os.makedirs(self.directory, exist_ok=True)
+            temporary = f'{self.path}.tmp'
+            with open(temporary, 'w', encoding='utf-8') as file:
+                json.dump(data, file, ensure_ascii=False)
+            os.replace(temporary, self.path)
+
+    def collect(self):
+        """Сумма значений всех процессов."""
+        self.flush(force=True)
+        values = defaultdict(float)
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path, encoding='utf-8') as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in data:
+                values[(name, tuple(sorted(labels.items())))] += value
+        return values
+
+
+registry = Registry()
+
+
+def record_cache(name, hit):
+    registry.inc(
+        'foodgram_cache_requests_total',
+        cache=name,
+        result='hit' if hit else 'miss',
+    )
+
+
+def get_base_name(series):
+    for name, (kind, _) in METRICS.items():
+        if series == name or kind == 'histogram' and series in (
+            f'{name}_bucket', f'{name}_sum', f'{name}_count'
+        ):
+            return name
+    return series
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    ) + '}'
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render(values):
+    """Значения в текстовом формате Prometheus."""
+    series = defaultdict(list)
+    for (name, labels), value in values.items():
+        series[get_base_name(name)].append((name, labels, value))
+    lines = []
+    for base in sorted(series):
+        kind, description = METRICS.get(base, ('untyped', ''))
+        lines.append(f'# HELP {base} {description}')
+        lines.append(f'# TYPE {base} {kind}')
+        for name, labels, value in sorted(series[base], key=lambda item: (
+            item[0],
+            [label for label in item[1] if label[0] != 'le'],
+            float(dict(item[1]).get('le', 0)),
+        )):
+            lines.append(
+                f'{name}{format_labels(labels)} {format_value(value)}'
+            )
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    if not registry.directory:
+        raise Http404
+    return HttpResponse(render(registry.collect()), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """Время ответа и число SQL-запросов по view для /metrics.
+
+    Включается настройкой METRICS_DIR; view определяется по имени
+    маршрута (recipes-list, recipes-favorite и т.п.), а не по пути,
+    чтобы число рядов не зависело от id в адресах.
+    """
+
+    def __init__(self, get_response):
+        if not registry.directory:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryTimer()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            start = time.perf_counter()
+            response = self.get_response(request)
+            duration = time.perf_counter() - start
+        view = getattr(request.resolver_match, 'view_name', None)
+        view = view or 'unmatched'
+        registry.inc(
+            'foodgram_http_requests_total',
+            view=view, method=request.method, status=str(response.status_code)
+        )
+        registry.observe(
+            'foodgram_http_request_duration_seconds', duration,
+            LATENCY_BUCKETS, view=view, method=request.method
+        )
+        registry.inc('foodgram_db_queries_total', queries.count, view=view)
+        registry.inc(
+            'foodgram_db_query_duration_seconds_total',
+            queries.duration / 1000, view=view
+        )
+        registry.flush()
+        return response
@@ -0,0 +1,139 @@
+import logging
+import re
+import sysconfig
+import traceback
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 5
+STACK_LIMIT = 8
+SKIPPED_STATEMENTS = ('SAVEPOINT', 'RELEASE', 'ROLLBACK', 'BEGIN', 'COMMIT')
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+PARAMS_RE = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+ROWS_RE = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+SPACE_RE = re.compile(r'\s+')
+LIBRARY_PATHS = tuple({
+    sysconfig.get_path(name) for name in ('stdlib', 'purelib', 'platlib')
+})
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    """Текст SQL без значений.
+
+    Запросы, отличающиеся только параметрами, длиной IN-списков
+    и числом строк в VALUES, дают одинаковый отпечаток.
+    """
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = PARAMS_RE.sub('(...)', sql)
+    sql = ROWS_RE.sub('(...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+def get_stack():
+    """Последние кадры стека без Django и других библиотек."""
+    frames = [
+        frame for frame in traceback.extract_stack()
+        if not frame.filename.startswith(LIBRARY_PATHS)
+        and frame.filename != __file__
+    ]
+    return ''.join(traceback.format_list(frames[-STACK_LIMIT:]))
+
+
+class RepeatedQueries:
+    """Execute wrapper, считающий запросы по отпечаткам.
+
+    Для отпечатка, превысившего порог, запоминается стек вызова,
+    на котором это произошло.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.counts = Counter()
+        self.stacks = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.lstrip().upper().startswith(SKIPPED_STATEMENTS):
+            key = fingerprint(sql)
+            self.counts[key] += 1
+            if self.counts[key] == self.threshold + 1:
+                self.stacks[key] = get_stack()
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def capture(self, using=None):
+        aliases = [using] if using else list(connections)
+        with ExitStack() as stack:
+            for alias in aliases:
+                stack.enter_context(connections[alias].execute_wrapper(self))
+            yield self
+
+    def repeated(self):
+        """Пары (отпечаток, число повторов) сверх порога."""
+        return [
+            (key, count) for key, count in self.counts.most_common()
+            if count > self.threshold
+        ]
+
+    def report(self):
+        return '\n\n'.join(
+            f'{count} x {key}\n{self.stacks[key]}'
+            for key, count in self.repeated()
+        )
+
+
+def get_threshold():
+    return getattr(settings, 'NPLUSONE_THRESHOLD', 0) or DEFAULT_THRESHOLD
+
+
+@contextmanager
+def detect_n_plus_one(threshold=None, using=None):
+    """Падает с NPlusOneError, если запрос повторился больше threshold раз.
+
+    Для тестов:
+        with detect_n_plus_one():
+            client.get('/api/recipes/')
+    """
+    queries = RepeatedQueries(threshold or get_threshold())
+    with queries.capture(using):
+        yield queries
+    if queries.repeated():
+        raise NPlusOneError(
+            'Повторяющиеся SQL-запросы (N+1):\n' + queries.report()
+        )
+
+
+class NPlusOneMiddleware:
+    """Пишет в лог запросы, повторившиеся за запрос больше порога раз.
+
+    Для staging: включается настройкой NPLUSONE_THRESHOLD, при 0
+    middleware не подключается.
+    """
+
+    def __init__(self, get_response):
+        self.threshold = getattr(settings, 'NPLUSONE_THRESHOLD', 0)
+        if not self.threshold:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = RepeatedQueries(self.threshold)
+        with queries.capture():
+            response = self.get_response(request)
+        if queries.repeated():
+            logger.warning(
+                'N+1 в %s %s:\n%s',
+                request.method, request.path, queries.report()
+            )
+        return response
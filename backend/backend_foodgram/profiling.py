@@ -0,0 +1,170 @@
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+class QueryTimer:
+    """Считает SQL-запросы и их суммарное время в мс.
+
+    Подключается через connection.execute_wrapper. CaptureQueriesContext
+    не подходит: он округляет время до миллисекунд и хранит текст
+    каждого запроса.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += (time.perf_counter() - start) * 1000
+            self.count += 1
+
+
+class Profile:
+    """Замеры одного запроса, в мс."""
+
+    def __init__(self):
+        self.queries = QueryTimer()
+        self.serializer = 0
+        self.serializer_start = None
+        self.view_start = None
+        self.render_start = None
+        self.view = None
+        self.render = None
+        self.total = None
+
+    def finish(self, start):
+        end = time.perf_counter()
+        self.total = (end - start) * 1000
+        if self.view_start is None:
+            return
+        if self.render_start is None:
+            self.view = (end - self.view_start) * 1000
+        else:
+            self.view = (self.render_start - self.view_start) * 1000
+            self.render = (end - self.render_start) * 1000
+
+    def metrics(self):
+        """Пары (имя, время, описание) для Server-Timing."""
+        metrics = [
+            ('db', self.queries.duration,
+             f'SQL ({self.queries.count})'),
+            ('serializer', self.serializer, 'Serializer'),
+            ('view', self.view, 'View'),
+            ('render', self.render, 'Render'),
+            ('total', self.total, 'Total'),
+        ]
+        return [metric for metric in metrics if metric[1] is not None]
+
+
+class ProfiledSerializerMixin:
+    """Замеряет сериализацию ответа во view DRF для ProfilingMiddleware.
+
+    Отсчёт идёт от создания сериализатора ответа до finalize_response:
+    в list и retrieve - от get_serializer без data, в create и update -
+    после сохранения. Action, создающий сериализатор сам, вызывает
+    start_serializer_timer.
+    """
+
+    def start_serializer_timer(self):
+        profile = current_profile.get()
+        if profile is not None and profile.serializer_start is None:
+            profile.serializer_start = time.perf_counter()
+
+    def get_serializer(self, *args, **kwargs):
+        if 'data' not in kwargs:
+            self.start_serializer_timer()
+        return super().get_serializer(*args, **kwargs)
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        self.start_serializer_timer()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        self.start_serializer_timer()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        profile = current_profile.get()
+        if profile is not None and profile.serializer_start is not None:
+            profile.serializer += (
+                time.perf_counter() - profile.serializer_start
+            ) * 1000
+            profile.serializer_start = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class ProfilingMiddleware:
+    """Замеряет долю запросов: SQL, сериализацию, view и рендеринг.
+
+    Включается настройкой PROFILING_SAMPLE_RATE (от 0 до 1); при 0
+    middleware не подключается. Результат отдаётся в заголовке
+    Server-Timing и пишется в лог строкой JSON.
+    """
+
+    def __init__(self, get_response):
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        if not self.sample_rate:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        profile = Profile()
+        token = current_profile.set(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(profile.queries)
+                    )
+                start = time.perf_counter()
+                response = self.get_response(request)
+                profile.finish(start)
+        finally:
+            current_profile.reset(token)
+        metrics = profile.metrics()
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={duration:.2f};desc="{description}"'
+            for name, duration, description in metrics
+        )
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(request.resolver_match, 'view_name', None),
+            'status': response.status_code,
+            'queries': profile.queries.count,
+            **{
+                f'{name}_ms': round(duration, 2)
+                for name, duration, _ in metrics
+            },
+        }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        """Ответы DRF рендерятся после выхода из view."""
+        profile = current_profile.get()
+        if profile is not None:
+            profile.render_start = time.perf_counter()
+        return response
@@ -10,6 +10,8 @@ local_url = os.getenv('LOCAL_URL', default='127.0.0.1')
 local_server_name = os.getenv('LOCALHOST', default='localhost')
 web_url = os.getenv('WEB_URL', default='uririfoodgram.serveblog.net')
 server_ip = os.getenv('SERVER_IP')
+# Имя сервиса в docker-compose: по нему Prometheus ходит на backend:8001.
+internal_host = os.getenv('INTERNAL_HOST', default='backend')
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -17,7 +19,9 @@ SECRET_KEY = str(os.getenv('SECRET_KEY'))
 
 DEBUG = strtobool(os.getenv('DEBUG', default='False'))
 
-ALLOWED_HOSTS = [server_ip, web_url, local_server_name, local_url]
+ALLOWED_HOSTS = [
+    server_ip, web_url, local_server_name, local_url, internal_host
+]
 
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -26,6 +30,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -38,6 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend_foodgram.metrics.MetricsMiddleware',
+    'backend_foodgram.profiling.ProfilingMiddleware',
+    'backend_foodgram.nplusone.NPlusOneMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,6 +86,19 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / 'cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 5000)),
+        },
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -111,6 +132,46 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Доля запросов (от 0 до 1), для которых пишутся Server-Timing и лог
+# с временем SQL, сериализации и рендеринга; 0 - профилирование выключено.
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+
+# Сколько одинаковых SQL-запросов за HTTP-запрос допустимо; при большем
+# числе в лог пишется предупреждение о N+1. 0 - проверка выключена.
+NPLUSONE_THRESHOLD = int(os.getenv('NPLUSONE_THRESHOLD', 0))
+
+# Каталог, куда процессы gunicorn сбрасывают метрики для /metrics
+# (не чаще раза в METRICS_FLUSH_INTERVAL секунд); пусто - метрик нет.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'backend_foodgram.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'backend_foodgram.nplusone': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -1,3 +1,4 @@
+from api.signals import per_row_refresh_paused
 from django.contrib import admin
 
 from . import models
@@ -30,6 +31,14 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('name', 'author', 'tags')
     empty_value_display = '-пусто-'
 
+    def delete_model(self, request, obj):
+        with per_row_refresh_paused():
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with per_row_refresh_paused():
+            super().delete_queryset(request, queryset)
+
 
 @admin.register(models.IngredientRecipe)
 class IngredientRecipeAdmin(admin.ModelAdmin):
@@ -47,3 +56,9 @@ class FavoriteAdmin(admin.ModelAdmin):
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('pk', 'user', 'recipe')
     list_editable = ('user', 'recipe')
+
+
+@admin.register(models.ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'user', 'ingredient', 'total_quantity')
+    list_filter = ('user',)
@@ -1,6 +1,7 @@
 import csv
 import os
 
+from api.cache import bump_versions
 from backend_foodgram import settings
 from django.core.management.base import BaseCommand
 from foodgram.models import Ingredient
@@ -23,3 +24,4 @@ class Command(BaseCommand):
                 )
                 data.append(ingredient)
         Ingredient.objects.bulk_create(data)
+        bump_versions(Ingredient._meta.db_table)
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from foodgram.models import IngredientRecipe, ShoppingListItem
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает агрегированные списки покупок '
+            'или проверяет их соответствие корзинам.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сравнить таблицу с корзинами, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self.verify()
+        with transaction.atomic():
+            ShoppingListItem.objects.refresh(User.objects.values('pk'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк в списках покупок: {ShoppingListItem.objects.count()}.'
+        ))
+
+    def verify(self):
+        expected = {
+            (row['recipe__shopping_cart__user'], row['ingredient']):
+                row['total_quantity']
+            for row in IngredientRecipe.objects
+            .filter(recipe__shopping_cart__isnull=False)
+            .values('recipe__shopping_cart__user', 'ingredient')
+            .annotate(total_quantity=Sum('quantity'))
+            .order_by()
+        }
+        actual = {
+            (user, ingredient): total_quantity
+            for user, ingredient, total_quantity
+            in ShoppingListItem.objects.values_list(
+                'user', 'ingredient', 'total_quantity'
+            )
+        }
+        mismatches = sorted(
+            key for key in expected.keys() | actual.keys()
+            if expected.get(key) != actual.get(key)
+        )
+        for user, ingredient in mismatches:
+            self.stderr.write(
+                f'user={user} ingredient={ingredient}: '
+                f'ожидалось {expected.get((user, ingredient))}, '
+                f'в таблице {actual.get((user, ingredient))}'
+            )
+        if mismatches:
+            raise CommandError(
+                f'Расхождений: {len(mismatches)}. '
+                'Запустите команду без --verify, чтобы пересчитать.'
+            )
+        self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
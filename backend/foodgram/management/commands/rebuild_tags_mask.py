@@ -0,0 +1,53 @@
+from api.cache import bump_versions
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from foodgram.models import Recipe, Tag
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает маски тегов рецептов '
+            'или проверяет их соответствие таблице recipe_tags.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сравнить маски с таблицей тегов, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        unmasked = Tag.objects.filter(bit__isnull=True).count()
+        if unmasked:
+            self.stderr.write(
+                f'Тегов без бита в маске: {unmasked}; '
+                'фильтр по ним идёт через recipe_tags.'
+            )
+        if options['verify']:
+            return self.verify()
+        updated = Recipe.objects.update_tags_mask()
+        bump_versions(Recipe._meta.db_table)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано масок: {updated}.'
+        ))
+
+    def verify(self):
+        mismatches = (
+            Recipe.objects
+            .alias(expected=Recipe.objects.expected_tags_mask())
+            .exclude(tags_mask=F('expected'))
+            .annotate(expected_tags_mask=F('expected'))
+            .values_list('pk', 'tags_mask', 'expected_tags_mask')
+            .order_by('pk')
+        )
+        count = 0
+        for pk, tags_mask, expected in mismatches:
+            count += 1
+            self.stderr.write(
+                f'recipe={pk}: ожидалось {expected:b}, в таблице {tags_mask:b}'
+            )
+        if count:
+            raise CommandError(
+                f'Расхождений: {count}. '
+                'Запустите команду без --verify, чтобы пересчитать.'
+            )
+        self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
@@ -0,0 +1,300 @@
+import io
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import partial
+from itertools import accumulate, islice
+
+from api.cache import bump_versions
+from api.signals import per_row_refresh_paused
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from foodgram.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                             ShoppingCart, ShoppingListItem, Tag,
+                             get_tags_mask)
+from PIL import Image
+from users.models import Follow, User
+
+SEED_EMAIL_DOMAIN = 'seed.foodgram'
+USERS_PER_SCALE = 100
+RECIPES_PER_SCALE = 500
+INGREDIENTS_PER_SCALE = 200
+IMAGES = 10
+TAGS = (
+    ('Завтрак', 'breakfast', '#E26C2D'),
+    ('Обед', 'lunch', '#49B64E'),
+    ('Ужин', 'dinner', '#8775D2'),
+    ('Десерт', 'dessert', '#F5A9B8'),
+    ('Перекус', 'snack', '#F9C74F'),
+    ('Напиток', 'drink', '#4D96FF'),
+)
+WORDS = (
+    'суп', 'салат', 'пирог', 'рагу', 'каша', 'запеканка', 'омлет', 'паста',
+    'котлеты', 'блины', 'соус', 'плов', 'жаркое', 'ризотто', 'смузи',
+    'домашний', 'быстрый', 'летний', 'острый', 'сливочный', 'овощной',
+    'томатный', 'грибной', 'куриный', 'рыбный', 'пряный', 'нежный',
+)
+
+
+class Zipf:
+    """Выбор элементов с вероятностью, обратной рангу в степени skew.
+
+    skew=0 - равномерное распределение. Ранги раздаются элементам
+    в случайном (но воспроизводимом) порядке.
+    """
+
+    def __init__(self, items, skew, rng):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.rng = rng
+        self.cum_weights = list(accumulate(
+            1 / rank ** skew for rank in range(1, len(self.items) + 1)
+        ))
+
+    def choices(self, k):
+        return self.rng.choices(self.items, cum_weights=self.cum_weights, k=k)
+
+    def sample(self, k, exclude=None):
+        """k различных элементов, кроме exclude."""
+        k = min(k, len(self.items) - (exclude is not None))
+        chosen = {}
+        while len(chosen) < k:
+            for item in self.choices(k - len(chosen)):
+                if item != exclude:
+                    chosen[item] = None
+        return list(islice(chosen, k))
+
+
+@contextmanager
+def explicit_pub_date():
+    """Позволяет записать свою дату публикации при bulk_create."""
+    field = Recipe._meta.get_field('pub_date')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = ('Генерирует синтетические данные для нагрузочных тестов: '
+            'пользователей, рецепты, избранное, корзины и подписки. '
+            'Результат воспроизводим при одинаковых --scale и --seed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=1,
+                            help=f'Множитель объёма: {USERS_PER_SCALE} '
+                                 f'пользователей и {RECIPES_PER_SCALE} '
+                                 'рецептов на единицу.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Начальное значение генератора.')
+        parser.add_argument('--author-skew', type=float, default=1.1,
+                            help='Zipf-показатель популярности авторов '
+                                 '(число рецептов и подписчиков).')
+        parser.add_argument('--recipe-skew', type=float, default=1.0,
+                            help='Zipf-показатель популярности рецептов '
+                                 'в избранном и корзинах.')
+        parser.add_argument('--ingredient-skew', type=float, default=1.0,
+                            help='Zipf-показатель частоты ингредиентов.')
+        parser.add_argument('--favorites', type=int, default=10,
+                            help='Среднее число избранных рецептов.')
+        parser.add_argument('--carts', type=int, default=3,
+                            help='Среднее число рецептов в корзине.')
+        parser.add_argument('--follows', type=int, default=5,
+                            help='Среднее число подписок.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить ранее сгенерированных '
+                                 'пользователей и их данные.')
+
+    def handle(self, *args, **options):
+        if options['scale'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--scale и --batch-size должны быть больше 0.')
+        seeded = User.objects.filter(email__endswith=f'@{SEED_EMAIL_DOMAIN}')
+        if options['clear']:
+            with per_row_refresh_paused():
+                seeded.delete()
+        elif seeded.exists():
+            raise CommandError('Сгенерированные данные уже есть в базе; '
+                               'добавьте --clear, чтобы заменить их.')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.counts = {}
+        started = time.monotonic()
+        with transaction.atomic():
+            self.generate(options)
+        for model, count in self.counts.items():
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.monotonic() - started:.1f} с.'
+        ))
+
+    def generate(self, options):
+        scale = options['scale']
+        tags = self.get_tags()
+        ingredients = self.get_ingredients(INGREDIENTS_PER_SCALE * scale)
+        users = self.create_users(USERS_PER_SCALE * scale)
+        authors = Zipf(users, options['author_skew'], self.rng)
+        recipes = self.create_recipes(
+            RECIPES_PER_SCALE * scale, authors, tags,
+            Zipf(ingredients, options['ingredient_skew'], self.rng)
+        )
+        popular = Zipf(recipes, options['recipe_skew'], self.rng)
+        self.create_user_lists(Favorite, users, popular, options['favorites'])
+        self.create_user_lists(ShoppingCart, users, popular, options['carts'])
+        self.create_follows(users, authors, options['follows'])
+        self.reset_sequences()
+        Recipe.objects.filter(pk__in=recipes).update_search_vector()
+        for start in range(0, len(users), self.batch_size):
+            ShoppingListItem.objects.refresh(
+                users[start:start + self.batch_size]
+            )
+        transaction.on_commit(partial(bump_versions, *(
+            model._meta.db_table for model in (
+                User, Recipe, Recipe.tags.through, IngredientRecipe,
+                Favorite, ShoppingCart, Follow, Ingredient, Tag,
+            )
+        )))
+
+    def get_tags(self):
+        for name, slug, color in TAGS:
+            if not Tag.objects.filter(slug=slug).exists():
+                Tag.objects.create(name=name, slug=slug, color=color)
+        return list(Tag.objects.order_by('pk'))
+
+    def get_ingredients(self, count):
+        ingredients = list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        if ingredients:
+            return ingredients
+        self.insert(Ingredient, (
+            Ingredient(pk=pk, name=f'ингредиент {pk}', measurement_unit='г')
+            for pk in range(1, count + 1)
+        ))
+        return list(range(1, count + 1))
+
+    def create_users(self, count):
+        start = self.next_pk(User)
+        password = make_password('foodgram')
+        ids = list(range(start, start + count))
+        self.insert(User, (
+            User(
+                pk=pk,
+                username=f'seed{pk}',
+                email=f'seed{pk}@{SEED_EMAIL_DOMAIN}',
+                first_name=f'Имя{pk}',
+                last_name=f'Фамилия{pk}',
+                password=password,
+            )
+            for pk in ids
+        ))
+        return ids
+
+    def create_recipes(self, count, authors, tags, ingredients):
+        start = self.next_pk(Recipe)
+        ids = list(range(start, start + count))
+        images = self.get_images()
+        now = timezone.now()
+        recipe_tags = {
+            pk: self.rng.sample(tags, self.rng.randint(1, 3)) for pk in ids
+        }
+        with explicit_pub_date():
+            self.insert(Recipe, (
+                Recipe(
+                    pk=pk,
+                    name=self.make_text(2, 4).capitalize(),
+                    text=self.make_text(20, 60).capitalize() + '.',
+                    author_id=author,
+                    image=self.rng.choice(images),
+                    cooking_time=self.rng.randint(5, 180),
+                    pub_date=now - timedelta(
+                        minutes=self.rng.randint(0, 60 * 24 * 365)
+                    ),
+                    tags_mask=get_tags_mask(recipe_tags[pk]),
+                )
+                for pk, author in zip(ids, authors.choices(count))
+            ))
+        self.insert(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=pk, tag_id=tag.pk)
+            for pk in ids for tag in recipe_tags[pk]
+        ))
+        self.insert(IngredientRecipe, (
+            IngredientRecipe(
+                recipe_id=pk,
+                ingredient_id=ingredient,
+                quantity=self.rng.randint(1, 500),
+            )
+            for pk in ids
+            for ingredient in ingredients.sample(self.rng.randint(3, 12))
+        ))
+        return ids
+
+    def create_user_lists(self, model, users, recipes, average):
+        self.insert(model, (
+            model(user_id=user, recipe_id=recipe)
+            for user in users
+            for recipe in recipes.sample(self.rng.randint(0, 2 * average))
+        ))
+
+    def create_follows(self, users, authors, average):
+        self.insert(Follow, (
+            Follow(user_id=user, author_id=author)
+            for user in users
+            for author in authors.sample(
+                self.rng.randint(0, 2 * average), exclude=user
+            )
+        ))
+
+    def get_images(self):
+        """Несколько однотонных картинок, общих для всех рецептов."""
+        names = []
+        for index in range(IMAGES):
+            name = f'recipes/seed_{index}.png'
+            if not default_storage.exists(name):
+                buffer = io.BytesIO()
+                # Отдельный генератор: картинки могли остаться от прошлого
+                # запуска, и основная последовательность не должна сбиться.
+                rng = random.Random(index)
+                color = tuple(rng.randrange(256) for _ in range(3))
+                Image.new('RGB', (64, 64), color).save(buffer, 'PNG')
+                name = default_storage.save(
+                    name, ContentFile(buffer.getvalue())
+                )
+            names.append(name)
+        return names
+
+    def make_text(self, minimum, maximum):
+        return ' '.join(
+            self.rng.choices(WORDS, k=self.rng.randint(minimum, maximum))
+        )
+
+    def insert(self, model, objects):
+        objects = iter(objects)
+        total = 0
+        while batch := list(islice(objects, self.batch_size)):
+            model.objects.bulk_create(batch)
+            total += len(batch)
+        self.counts[model] = self.counts.get(model, 0) + total
+
+    @staticmethod
+    def next_pk(model):
+        return (model.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1
+
+    @staticmethod
+    def reset_sequences():
+        """Явные id не сдвигают последовательности PostgreSQL."""
+        sql = connection.ops.sequence_reset_sql(no_style(), [
+            User, Ingredient, Recipe, Recipe.tags.through, IngredientRecipe,
+            Favorite, ShoppingCart, Follow,
+        ])
+        with connection.cursor() as cursor:
+            for statement in sql:
+                cursor.execute(statement)
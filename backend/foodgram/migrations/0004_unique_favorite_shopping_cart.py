@@ -0,0 +1,59 @@
+# Generated by Django 3.2 on 2026-10-17 06:57
+
+from django.db import migrations, models
+
+
+def delete_duplicates(model):
+    duplicates = (
+        model.objects
+        .values('user', 'recipe')
+        .annotate(first_id=models.Min('id'), total=models.Count('id'))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    deleted = 0
+    for row in duplicates:
+        deleted += model.objects.filter(
+            user=row['user'], recipe=row['recipe']
+        ).exclude(id=row['first_id']).delete()[0]
+    return deleted
+
+
+def deduplicate(apps, schema_editor):
+    delete_duplicates(apps.get_model('foodgram', 'Favorite'))
+    if not delete_duplicates(apps.get_model('foodgram', 'ShoppingCart')):
+        return
+    IngredientRecipe = apps.get_model('foodgram', 'IngredientRecipe')
+    ShoppingListItem = apps.get_model('foodgram', 'ShoppingListItem')
+    ShoppingListItem.objects.all().delete()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=row['recipe__shopping_cart__user'],
+            ingredient_id=row['ingredient'],
+            total_quantity=row['total_quantity'],
+        )
+        for row in IngredientRecipe.objects
+        .filter(recipe__shopping_cart__isnull=False)
+        .values('recipe__shopping_cart__user', 'ingredient')
+        .annotate(total_quantity=models.Sum('quantity'))
+        .order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0003_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favorite'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_shopping_cart'),
+        ),
+    ]
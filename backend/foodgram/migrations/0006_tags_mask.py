@@ -0,0 +1,57 @@
+# Generated by Django 3.2 on 2026-10-17 07:05
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+TAG_MASK_BITS = 63
+
+
+def fill_tags_mask(apps, schema_editor):
+    Tag = apps.get_model('foodgram', 'Tag')
+    Recipe = apps.get_model('foodgram', 'Recipe')
+    tags = list(Tag.objects.order_by('id')[:TAG_MASK_BITS])
+    for bit, tag in enumerate(tags):
+        tag.bit = bit
+    Tag.objects.bulk_update(tags, ['bit'])
+    masks = defaultdict(int)
+    for recipe_id, bit in (
+        Recipe.tags.through.objects
+        .filter(tag__bit__isnull=False)
+        .values_list('recipe_id', 'tag__bit')
+    ):
+        masks[recipe_id] |= 1 << bit
+    recipes = defaultdict(list)
+    for recipe_id, mask in masks.items():
+        recipes[mask].append(recipe_id)
+    for mask, recipe_ids in recipes.items():
+        Recipe.objects.filter(pk__in=recipe_ids).update(tags_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0005_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Маска тегов'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, unique=True, verbose_name='Бит в маске тегов рецепта'),
+        ),
+        migrations.RunPython(fill_tags_mask, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', '-id', 'tags_mask'], name='recipe_pub_date_tags_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='recipe',
+            name='recipe_pub_date_id_idx',
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2 on 2026-10-17 07:10
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+CREATE_INDEX = '''
+    CREATE INDEX recipe_search_vector_idx
+    ON foodgram_recipe USING gin (search_vector)
+'''
+FILL_SEARCH_VECTOR = '''
+    UPDATE foodgram_recipe AS recipe SET search_vector =
+        setweight(to_tsvector('russian', recipe.name), 'A')
+        || setweight(to_tsvector('russian', coalesce((
+            SELECT string_agg(ingredient.name, ' ')
+            FROM foodgram_ingredientrecipe AS ingredient_recipe
+            JOIN foodgram_ingredient AS ingredient
+                ON ingredient.id = ingredient_recipe.ingredient_id
+            WHERE ingredient_recipe.recipe_id = recipe.id
+        ), '')), 'B')
+        || setweight(to_tsvector('russian', recipe.text), 'C')
+'''
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(FILL_SEARCH_VECTOR)
+    schema_editor.execute(CREATE_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0006_tags_mask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,10 +1,21 @@
+from functools import partial
+
+from api.cache import SHOPPING_CART_VERSION, bump_versions
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import (Count, Exists, OuterRef, Prefetch, Subquery, Sum,
+                              Value, Window)
+from django.db.models.functions import Cast, Coalesce, Power
 from users.models import User
 
 MAX_LENGTH_NAME = 200
 MAX_LENGTH_SLUG = 50
 MAX_LENGTH_TAG = 7
+TAG_MASK_BITS = 63
+SEARCH_CONFIG = 'russian'
 
 
 class Ingredient(models.Model):
@@ -43,6 +54,12 @@ class Tag(models.Model):
         db_index=True,
         verbose_name="Slug тега"
     )
+    bit = models.PositiveSmallIntegerField(
+        null=True,
+        unique=True,
+        editable=False,
+        verbose_name='Бит в маске тегов рецепта'
+    )
 
     class Meta:
         verbose_name = 'Тег'
@@ -51,6 +68,135 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            used = set(
+                Tag.objects.filter(bit__isnull=False)
+                .values_list('bit', flat=True)
+            )
+            self.bit = next(
+                (bit for bit in range(TAG_MASK_BITS) if bit not in used),
+                None
+            )
+        super().save(*args, **kwargs)
+
+    @property
+    def mask(self):
+        """Бит тега в Recipe.tags_mask; 0, если свободных битов не было."""
+        return 0 if self.bit is None else 1 << self.bit
+
+
+def get_tags_mask(tags):
+    mask = 0
+    for tag in tags:
+        mask |= tag.mask
+    return mask
+
+
+class RecipeQuerySet(models.QuerySet):
+
+    def latest_per_author(self, limit):
+        """Не более limit последних рецептов каждого автора.
+
+        Ограничение считается коррелированным подзапросом, поэтому
+        превью для всех авторов страницы загружаются одним запросом.
+        """
+        if limit is None:
+            return self
+        if limit == 0:
+            return self.none()
+        return self.filter(pk__in=Subquery(
+            Recipe.objects.filter(
+                author=OuterRef('author')
+            ).values('pk')[:limit]
+        ))
+
+    def preview_with_total(self, limit):
+        """Первые limit рецептов и общее число рецептов в выборке.
+
+        Общее число считается оконной функцией в том же запросе.
+        """
+        if limit == 0:
+            return [], self.count()
+        recipes = self.annotate(total=Window(expression=Count('pk')))
+        if limit is not None:
+            recipes = recipes[:limit]
+        recipes = list(recipes)
+        return recipes, recipes[0].total if recipes else 0
+
+    def with_user_flags(self, user):
+        """Аннотирует is_favorited и is_in_shopping_cart для user."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+        )
+
+    def expected_tags_mask(self):
+        """Маска тегов рецепта, посчитанная по таблице recipe_tags."""
+        return Coalesce(Subquery(
+            Recipe.tags.through.objects
+            .filter(recipe=OuterRef('pk'), tag__bit__isnull=False)
+            .values('recipe')
+            .annotate(mask=Sum(Cast(
+                Power(2, 'tag__bit'), models.BigIntegerField()
+            )))
+            .values('mask')
+        ), 0)
+
+    def update_tags_mask(self):
+        """Пересчитывает tags_mask одним UPDATE."""
+        return self.update(tags_mask=self.expected_tags_mask())
+
+    def update_search_vector(self):
+        """Пересчитывает search_vector одним UPDATE.
+
+        Веса: название - A, ингредиенты - B, описание - C.
+        Вне PostgreSQL поле не используется.
+        """
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        ingredients = Coalesce(Subquery(
+            IngredientRecipe.objects
+            .filter(recipe=OuterRef('pk'))
+            .values('recipe')
+            .annotate(names=StringAgg('ingredient__name', ' '))
+            .values('names')
+        ), Value(''))
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(ingredients, weight='B', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+        ))
+
+    def for_read(self, user):
+        """План загрузки для RecipeReadSerializer.
+
+        Число запросов не зависит ни от количества рецептов,
+        ни от количества ингредиентов в них.
+        """
+        return self.with_user_flags(user).prefetch_related(
+            Prefetch(
+                'author',
+                queryset=User.objects.with_is_subscribed(user)
+            ),
+            'tags',
+            Prefetch(
+                'ingredient_recipes',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            ),
+        )
+
 
 class Recipe(models.Model):
     name = models.CharField(
@@ -61,6 +207,7 @@ class Recipe(models.Model):
         User,
         related_name='recipes',
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Автор рецепта'
     )
     image = models.ImageField(
@@ -82,15 +229,32 @@ class Recipe(models.Model):
     cooking_time = models.IntegerField()
     pub_date = models.DateTimeField(
         'Дата добавления',
-        auto_now_add=True,
-        db_index=True
+        auto_now_add=True
+    )
+    tags_mask = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Маска тегов'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор'
     )
 
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         default_related_name = 'recipes'
+        indexes = [
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=['-pub_date', '-id', 'tags_mask'],
+                         name='recipe_pub_date_tags_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -107,6 +271,7 @@ class IngredientRecipe(models.Model):
         Recipe,
         related_name='ingredient_recipes',
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Рецепт'
     )
     quantity = models.IntegerField(
@@ -131,10 +296,131 @@ class IngredientRecipe(models.Model):
                 f'{self.ingredient.measurement_unit}.')
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    """Добавление и удаление рецепта в избранном и списке покупок."""
+
+    add_sql = '''
+        WITH recipe AS (
+            SELECT id, name, image, cooking_time FROM {recipe}
+            WHERE id = %s
+        ), inserted AS (
+            INSERT INTO {table} (user_id, recipe_id)
+            SELECT %s, id FROM recipe
+            ON CONFLICT (user_id, recipe_id) DO NOTHING
+            RETURNING recipe_id
+        )
+        SELECT id, name, image, cooking_time, EXISTS (SELECT 1 FROM inserted)
+        FROM recipe
+    '''
+
+    @staticmethod
+    def clean_recipe_id(recipe_id):
+        try:
+            return Recipe._meta.pk.to_python(recipe_id)
+        except ValidationError:
+            return None
+
+    def add(self, user, recipe_id):
+        """Добавляет рецепт пользователю.
+
+        В PostgreSQL это один запрос INSERT ... ON CONFLICT DO NOTHING,
+        который заодно возвращает поля рецепта для ответа. Как и remove,
+        не отправляет сигналы модели: список покупок пересчитывает
+        вызывающий код.
+        Возвращает пару (рецепт или None, создана ли запись).
+        """
+        recipe_id = self.clean_recipe_id(recipe_id)
+        if recipe_id is None:
+            return None, False
+        connection = connections[self.db]
+        if connection.vendor != 'postgresql':
+            recipe = Recipe.objects.only(
+                'id', 'name', 'image', 'cooking_time'
+            ).filter(pk=recipe_id).first()
+            if recipe is None:
+                return None, False
+            if self.filter(user=user, recipe=recipe).exists():
+                return recipe, False
+            self.bulk_create(
+                [self.model(user=user, recipe=recipe)], ignore_conflicts=True
+            )
+            return recipe, True
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self.add_sql.format(
+                    recipe=connection.ops.quote_name(Recipe._meta.db_table),
+                    table=connection.ops.quote_name(self.model._meta.db_table)
+                ),
+                [recipe_id, user.pk]
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None, False
+        recipe = Recipe(id=row[0], name=row[1], image=row[2],
+                        cooking_time=row[3])
+        return recipe, row[4]
+
+    def remove(self, user, recipe_id):
+        """Удаляет рецепт одним DELETE; возвращает, была ли запись."""
+        recipe_id = self.clean_recipe_id(recipe_id)
+        if recipe_id is None:
+            return False
+        connection = connections[self.db]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM '
+                f'{connection.ops.quote_name(self.model._meta.db_table)} '
+                f'WHERE user_id = %s AND recipe_id = %s',
+                [user.pk, recipe_id]
+            )
+            return cursor.rowcount > 0
+
+    def add_many(self, user, recipe_ids):
+        """Добавляет пользователю несколько рецептов одним INSERT.
+
+        Возвращает пару множеств id: добавленные и уже бывшие
+        у пользователя. Несуществующие рецепты не попадают ни в одно.
+        """
+        found = set(
+            Recipe.objects.filter(pk__in=recipe_ids)
+            .values_list('pk', flat=True)
+        )
+        existing = set(
+            self.filter(user=user, recipe_id__in=found)
+            .values_list('recipe_id', flat=True)
+        )
+        created = found - existing
+        self.bulk_create(
+            [self.model(user=user, recipe_id=pk) for pk in created],
+            ignore_conflicts=True
+        )
+        return created, existing
+
+    def remove_many(self, user, recipe_ids):
+        """Удаляет несколько рецептов одним DELETE; возвращает их id."""
+        removed = set(
+            self.filter(user=user, recipe_id__in=recipe_ids)
+            .values_list('recipe_id', flat=True)
+        )
+        if not removed:
+            return removed
+        connection = connections[self.db]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM '
+                f'{connection.ops.quote_name(self.model._meta.db_table)} '
+                f'WHERE user_id = %s AND recipe_id IN '
+                f'({", ".join(["%s"] * len(removed))})',
+                [user.pk, *removed]
+            )
+        return removed
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Автор списка избранного'
     )
     recipe = models.ForeignKey(
@@ -143,10 +429,18 @@ class Favorite(models.Model):
         verbose_name='Избранный рецепт'
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         default_related_name = 'favorite_recipes'
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_favorite'
+            )
+        ]
 
     def __str__(self):
         return f'{self.user.username}: {self.recipe.name}'
@@ -156,6 +450,7 @@ class ShoppingCart(models.Model):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Автор списка покупок'
     )
     recipe = models.ForeignKey(
@@ -164,10 +459,93 @@ class ShoppingCart(models.Model):
         verbose_name='Рецепт в списке покупок'
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         default_related_name = 'shopping_cart'
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_shopping_cart'
+            )
+        ]
 
     def __str__(self):
         return f'{self.user.username}: {self.recipe.name}'
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+
+    def refresh(self, users, ingredients=None):
+        """Пересчитывает агрегат списка покупок для users.
+
+        Если переданы ingredients, затрагиваются только их строки.
+        Вызывается внутри транзакции, в которой меняется список покупок,
+        чтобы агрегат не расходился с корзиной. После коммита сбрасывает
+        версии корзин users.
+        """
+        with transaction.atomic(using=self.db, savepoint=False):
+            locked = list(
+                User.objects.select_for_update().filter(pk__in=users)
+                .values_list('pk', flat=True)
+            )
+            if locked:
+                transaction.on_commit(partial(bump_versions, *(
+                    SHOPPING_CART_VERSION.format(pk) for pk in locked
+                )), using=self.db)
+            stale = self.filter(user__in=users)
+            totals = IngredientRecipe.objects.filter(
+                recipe__shopping_cart__user__in=users
+            )
+            if ingredients is not None:
+                stale = stale.filter(ingredient__in=ingredients)
+                totals = totals.filter(ingredient__in=ingredients)
+            stale.delete()
+            self.bulk_create(
+                ShoppingListItem(
+                    user_id=row['recipe__shopping_cart__user'],
+                    ingredient_id=row['ingredient'],
+                    total_quantity=row['total_quantity'],
+                )
+                for row in totals.values(
+                    'recipe__shopping_cart__user', 'ingredient'
+                ).annotate(total_quantity=Sum('quantity')).order_by()
+            )
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_index=False,
+        verbose_name='Автор списка покупок'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    total_quantity = models.PositiveIntegerField(
+        verbose_name='Общее количество'
+    )
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        default_related_name = 'shopping_list_items'
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Строки списка покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return (f'{self.user.username}: '
+                f'{self.ingredient.name} '
+                f'{self.total_quantity} '
+                f'{self.ingredient.measurement_unit}.')
@@ -1,3 +1,4 @@
+from api.signals import per_row_refresh_paused
 from django.contrib import admin
 
 from . import models
@@ -13,6 +14,14 @@ class UserAdmin(admin.ModelAdmin):
     search_fields = ('username', 'email')
     empty_value_display = '-пусто-'
 
+    def delete_model(self, request, obj):
+        with per_row_refresh_paused():
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with per_row_refresh_paused():
+            super().delete_queryset(request, queryset)
+
 
 @admin.register(models.Follow)
 class FollowAdmin(admin.ModelAdmin):
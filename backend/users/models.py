@@ -1,9 +1,61 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
+from django.db.models import Exists, OuterRef, Value
 
 EMAIL_MAX_LENGTH = 254
 
 
+class UserQuerySet(models.QuerySet):
+
+    def with_is_subscribed(self, user):
+        """Аннотирует is_subscribed: подписан ли user на пользователя."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=models.BooleanField())
+            )
+        return self.annotate(
+            is_subscribed=Exists(Follow.objects.filter(
+                user=user, author=OuterRef('pk')
+            ))
+        )
+
+
+class FollowQuerySet(models.QuerySet):
+
+    def add_many(self, user, author_ids):
+        """Подписывает user на несколько авторов одним INSERT.
+
+        Возвращает пару множеств id: новые подписки и уже существующие.
+        Несуществующие авторы и сам user не попадают ни в одно.
+        """
+        found = set(
+            User.objects.filter(pk__in=author_ids).exclude(pk=user.pk)
+            .values_list('pk', flat=True)
+        )
+        existing = set(
+            self.filter(user=user, author_id__in=found)
+            .values_list('author_id', flat=True)
+        )
+        created = found - existing
+        self.bulk_create(
+            [self.model(user=user, author_id=pk) for pk in created],
+            ignore_conflicts=True
+        )
+        return created, existing
+
+    def remove_many(self, user, author_ids):
+        """Отписывает user от нескольких авторов; возвращает их id."""
+        subscriptions = self.filter(user=user, author_id__in=author_ids)
+        removed = set(subscriptions.values_list('author_id', flat=True))
+        if removed:
+            subscriptions.delete()
+        return removed
+
+
+class CustomUserManager(UserManager.from_queryset(UserQuerySet)):
+    pass
+
+
 class User(AbstractUser):
     email = models.EmailField(
         verbose_name='Адрес электронной почты',
@@ -13,6 +65,8 @@ class User(AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name', 'username']
 
+    objects = CustomUserManager()
+
     class Meta:
         ordering = ['id']
         verbose_name = 'Пользователь'
@@ -27,6 +81,7 @@ class Follow(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='follower',
+        db_index=False,
         verbose_name='Подписчик'
     )
     author = models.ForeignKey(
@@ -36,6 +91,8 @@ class Follow(models.Model):
         verbose_name='Автор'
     )
 
+    objects = FollowQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка на авторов'
         verbose_name_plural = 'Подписки на авторов'